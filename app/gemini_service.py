@@ -1,142 +1,363 @@
-import json
+import logging
 import os
 import asyncio 
-from typing import Optional, Dict, Any, List, Literal
-from datetime import datetime
+import httpx
+import orjson
+from typing import Optional, Dict, Any, List, AsyncIterator
+from datetime import date
 from pydantic import BaseModel
 
 # --- Official Google GenAI SDK ---
 from google import genai
 from google.genai import types
 from google.genai.errors import APIError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 # --- Local Imports ---
-from app.models import TradeCreate, Message
+from app.models import TradeCreate, Message, IntentAndTrade
+from app.intent_cache import SemanticIntentCache
+from app.trade_context import OMITTED_CONTEXT, needs_trade_context, session_trade_context
+from app.history import pack_history
+from app.prefilter import may_contain_trade
+from app.http_client import SHARED_HTTPX
+from app.resilience import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+class AnalysisResult(BaseModel):
+    summary: str
+    insights: List[str]
+
+class TitleResult(BaseModel):
+    title: str
+
+# --- Generation Configs ---
+# Immutable, so built once at import instead of per call / per retry.
+
+_EXTRACTION_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=IntentAndTrade,
+)
+
+_ANALYSIS_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=AnalysisResult,
+)
+
+# Titles are a handful of words; cap output and skip thinking
+_TITLE_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=TitleResult,
+    max_output_tokens=32,
+    thinking_config=types.ThinkingConfig(thinking_budget=0),
+)
+
+_CHAT_TOOLS = [types.Tool(google_search=types.GoogleSearch())]
+
+# --- Static Prompt Prefixes ---
+# Static instructions come FIRST and per-request values LAST so Gemini's
+# implicit prompt cache can reuse the shared prefix across calls.
+
+_ANALYSIS_PROMPT_PREFIX = (
+    "Analyze this trade data and return a JSON object with a 'summary' and a list of 'insights'.\n"
+    "Trades: "
+)
+
+_TITLE_PROMPT_PREFIX = "Generate a 3-5 word title for this conversation. Return JSON: {'title': '...'}\n\n"
+
+_EXTRACTION_PROMPT_PREFIX = """
+You are a strict Trading Journal Classifier and Data Extraction Agent.
+
+Step 1: Classify the user's PRIMARY intent.
+- LOG_TRADE (User is explicitly reporting a completed trade)
+- REVIEW_ANALYSIS (User wants to analyze past performance)
+- NEWS_MARKET (User is asking about current prices or news)
+- PLAN_STRATEGY (User is asking for advice or planning)
+- OTHER (General chat)
+
+Step 2: Only if intent is LOG_TRADE, extract the COMPLETED trade into `trade`.
+Rules:
+- Default quantity to 1 if missing.
+- Use Today's date when no date is mentioned.
+- Leave `trade` null for every other intent or if no valid trade is found.
+
+Examples (Today = 2024-03-15):
+- "Bought 10 TSLA at 250" -> {"intent": "LOG_TRADE", "trade": {"ticker": "TSLA", "entry_date": "2024-03-15", "entry_price": 250, "quantity": 10}}
+- "sold my AAPL at 190, got in at 175" -> {"intent": "LOG_TRADE", "trade": {"ticker": "AAPL", "entry_date": "2024-03-15", "entry_price": 175, "quantity": 1, "exit_date": "2024-03-15", "exit_price": 190}}
+- "What is NVDA doing today?" -> {"intent": "NEWS_MARKET", "trade": null}
+- "How did my trades go this month?" -> {"intent": "REVIEW_ANALYSIS", "trade": null}
+"""
+
+# Byte-identical on every request; per-user trade history is sent as a
+# separate [CONTEXT] turn so it never invalidates this cached prefix.
+SYSTEM_PROTOCOL = """
+You are an expert Trading Journal AI Assistant (Gemini).
+
+[DATA SOURCES]
+1. **Internal Trade History:** (provided in a [CONTEXT] message right before the latest user message)
+2. **Google Search Tool:** (Use for real-time news/prices)
+
+[PROTOCOL]
+- **NEWS/MARKET:** You MUST use the `Google Search` tool.
+- **ANALYSIS:** Analyze the Internal Trade History.
+- **LOGGING A TRADE:** If the user says "I bought..." or "Log this...", provide a **neutral, short acknowledgment** (e.g., "Understood," "Processing entry," or "Got it").
+  **IMPORTANT:** DO NOT confirm the trade details (price, ticker) yourself. The system will auto-generate the confirmation message.
+- **GENERAL/OTHER:** Respond naturally and helpfully.
+
+[EXAMPLES]
+User: "I bought 20 AMD at 155 this morning"
+Assistant: "Got it."
+
+User: "What's moving NVDA today?"
+Assistant: (searches Google for the latest NVDA news, then summarizes the key headlines and price action with sources)
+
+User: "What's my win rate on TSLA?"
+Assistant: (uses the Internal Trade History to count winning vs losing TSLA trades and reports the percentage, noting the sample size)
+
+User: "Should I add to my AAPL position before earnings?"
+Assistant: (weighs the user's AAPL history against current news, lists risks on both sides, and avoids giving definitive financial advice)
+"""
+
+_CHAT_CONFIG = types.GenerateContentConfig(
+    system_instruction=SYSTEM_PROTOCOL,
+    tools=_CHAT_TOOLS,
+    temperature=0.7,
+)
+
+# Rate limits, overload and dropped connections/timeouts are worth retrying
+# (and count against the breaker); anything else fails straight to the fallback
+_RETRYABLE_CODES = {429, 500, 503}
+
+def _is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.TransportError):
+        return True
+    return isinstance(exc, APIError) and exc.code in _RETRYABLE_CODES
+
+_CHAT_FALLBACK_MSG = "I apologize, but my market intelligence service is overloaded right now. Please try again in a moment."
+
+class GeminiBatcher:
+    """
+    Micro-batcher for fire-and-forget structured JSON calls.
+    Requests arriving within `window_ms` are launched together via asyncio.gather.
+    """
+
+    def __init__(self, generate, window_ms: int = 25):
+        self._generate = generate
+        self._window = window_ms / 1000
+        self._pending: List[tuple] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def submit(self, **kwargs):
+        """Queues one generate_content call and waits for its response."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((kwargs, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+        return await future
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self._window)
+        batch, self._pending = self._pending, []
+        self._flush_task = None
+
+        results = await asyncio.gather(
+            *(self._generate(**kwargs) for kwargs, _ in batch),
+            return_exceptions=True,
+        )
+        for (_, future), result in zip(batch, results):
+            if future.done():  # Caller was cancelled while waiting
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
 
-# Define the Intent Classification model
-class IntentResponse(BaseModel):
-    intent: Literal["LOG_TRADE", "REVIEW_ANALYSIS", "NEWS_MARKET", "PLAN_STRATEGY", "OTHER"]
 
 class AIService:
     """
     AI Service using Google Gemini 2.5.
-    Features: Sequenti+al Classification, Robust Error Handling, and Google Search Grounding.
+    Features: Fused Classification + Extraction, Robust Error Handling, and Google Search Grounding.
     """
 
+    _instance: Optional["AIService"] = None
+
     def __init__(self):
         api_key = os.environ.get("GEMINI_API_KEY")
         
         if not api_key:
             raise ValueError("GEMINI_API_KEY is missing. Cannot initialize AI client.")
         
-        self.client = genai.Client(api_key=api_key)
+        self._api_key = api_key
+        # Built lazily on first use, then reused for the lifetime of the singleton
+        self._client: Optional[genai.Client] = None
         # Gemini 2.5 Flash is fast and cost-effective
         self.model_id = "gemini-2.5-flash"
+        # Titles don't need the full model
+        self.title_model_id = "gemini-2.5-flash-lite"
         
-        # Config for fast intent classification
-        self.classification_config = types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=IntentResponse
+        # Intents seen for repeat/near-duplicate phrasings ("buy TSLA", "bought TSLA") let extraction skip the LLM
+        self.intent_cache = SemanticIntentCache(
+            db_path=os.environ.get("INTENT_CACHE_DB", "intent_cache_gemini.db")
         )
 
+        # Bounds in-flight Gemini calls so load spikes don't trigger 503 storms
+        self._sem = asyncio.Semaphore(int(os.environ.get("GEMINI_MAX_CONCURRENCY", "8")))
 
-    async def classify_intent(self, text: str) -> str:
-        """
-        STAGE 1: Fast classification of user intent.
-        Returns 'OTHER' if the API fails, ensuring no crashes.
-        """
-        MAX_RETRIES = 2
-        
-        prompt = f"""
-        Classify the user's PRIMARY intent.
-        Categories: 
-        - LOG_TRADE (User is explicitly reporting a completed trade)
-        - REVIEW_ANALYSIS (User wants to analyze past performance)
-        - NEWS_MARKET (User is asking about current prices or news)
-        - PLAN_STRATEGY (User is asking for advice or planning)
-        - OTHER (General chat)
-        
-        Input: "{text}"
-        """
-        
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = await self.client.aio.models.generate_content(
-                    model=self.model_id, 
-                    contents=prompt,
-                    config=self.classification_config,
-                )
-                
-                data = json.loads(response.text)
-                return data.get("intent", "OTHER").upper()
-            
-            except Exception as e:
-                # If temporary error, retry. If final error, return safe default.
-                if attempt < MAX_RETRIES - 1:
-                    await asyncio.sleep(1)
-                else:
-                    print(f"⚠️ Classification Failed: {e}")
-                    return "OTHER"
-        
-        return "OTHER"
+        # Fails fast to the fallback while Gemini is down instead of retrying every request
+        self.breaker = CircuitBreaker("gemini", fail_max=5, reset_timeout=30, is_failure=_is_transient)
+
+        # Coalesces bursty analysis/title requests into a single gather launch
+        self.batcher = GeminiBatcher(
+            self._call_once,
+            window_ms=int(os.environ.get("GEMINI_BATCH_WINDOW_MS", "25")),
+        )
+
+
+    @classmethod
+    def get(cls) -> "AIService":
+        """Process-wide singleton so every request shares one client and connection pool."""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+
+    @property
+    def client(self) -> genai.Client:
+        if self._client is None:
+            # Tuned connection pool: the SDK default serializes concurrent requests under load.
+            # An explicit httpx client is required: with async_client_args alone the SDK
+            # switches to aiohttp whenever it is installed and drops those args.
+            # The SDK doesn't close a client it was given; the lifespan does.
+            self._client = genai.Client(
+                api_key=self._api_key,
+                http_options=types.HttpOptions(
+                    timeout=30_000,  # milliseconds
+                    httpx_async_client=SHARED_HTTPX,
+                ),
+            )
+        return self._client
+
+
+    async def _generate(self, **kwargs):
+        """Single entry point for generate_content, gated by the concurrency semaphore."""
+        async with self._sem:
+            return await self.client.aio.models.generate_content(**kwargs)
 
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential_jitter(initial=0.5, max=4),
+        retry=retry_if_exception(_is_transient),
+        reraise=True,
+    )
+    async def _generate_with_retry(self, **kwargs):
+        return await self._generate(**kwargs)
+
+    async def _call(self, **kwargs):
+        """Retried, circuit-broken generate_content for the latency-critical paths."""
+        return await self.breaker.call(self._generate_with_retry, **kwargs)
+
+    async def _call_once(self, **kwargs):
+        """Circuit-broken generate_content without retries, for the batched background calls."""
+        return await self.breaker.call(self._generate, **kwargs)
 
     async def extract_trade_from_text(self, text: str) -> Optional[TradeCreate]:
         """
-        STAGE 2: Extracts trade data. 
-        - Only runs if intent is LOG_TRADE.
+        Classifies and extracts in ONE call (intent + optional trade).
+        - Returns the trade only if intent is LOG_TRADE.
         - Returns None if extraction fails (prevents 500 errors).
         """
-        
-        # 1. Sequential Intent Check
-        intent = await self.classify_intent(text)
-        if intent != "LOG_TRADE":
-            return None 
-
-        # 2. Detailed Extraction
-        today = datetime.now().strftime('%Y-%m-%d')
-        MAX_RETRIES = 3
-        
-        prompt = f"""
-        You are a strict Data Extraction Agent. 
-        Context Date: {today}.
-        User Input: "{text}"
-        
-        Task: Extract details of the COMPLETED trade.
-        Rules:
-        - Return valid JSON matching TradeCreate schema.
-        - Default quantity to 1 if missing.
-        - Return the string 'null' if no valid trade is found.
-        """
 
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = await self.client.aio.models.generate_content(
-                    model=self.model_id,
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        response_schema=TradeCreate,
-                    ),
-                )
-    
-                if response.text and response.text.strip().lower() not in ["null", "none"]:
-                    return TradeCreate.model_validate_json(response.text)
-                return None
-                
-            except APIError as e:
-                # Handle Service Unavailable (503)
-                if "503" in str(e) and attempt < MAX_RETRIES - 1:
-                    print(f"Extraction 503 Error. Retrying in {2 ** attempt}s...")
-                    await asyncio.sleep(2 ** attempt)
-                else:
-                    print(f"❌ Extraction Final Error: {e}")
-                    return None
-            except Exception as e:
-                print(f"❌ Extraction Internal Error: {e}")
+        # Obvious non-trades ("hi", "thanks", "what is NVDA doing?") skip the LLM
+        if not may_contain_trade(text):
+            return None
+
+        # A cached non-trade intent (exact or near-duplicate) means there is nothing to extract
+        cached_intent = await self.intent_cache.lookup(text)
+        if cached_intent is not None and cached_intent != "LOG_TRADE":
+            return None
+
+        result = await self._classify_and_extract(text)
+        if result is None:
+            return None
+
+        await self.intent_cache.remember(text, result.intent)
+        return result.trade if result.intent == "LOG_TRADE" else None
+
+
+    def _extraction_request(self, text: str) -> Dict[str, Any]:
+        """generate_content kwargs for the fused classification + extraction call."""
+        # Date goes after the static prefix, right before the user text
+        today = date.today().isoformat()
+        return {
+            "model": self.model_id,
+            "contents": _EXTRACTION_PROMPT_PREFIX + f'\nToday: {today}\nInput: "{text}"',
+            "config": _EXTRACTION_CONFIG,
+        }
+
+
+    async def _classify_and_extract(self, text: str) -> Optional[IntentAndTrade]:
+        """Single fused classification + extraction round-trip. Returns None on failure."""
+        try:
+            response = await self._call(**self._extraction_request(text))
+
+            if not response.text:
                 return None
-        
-        return None
+
+            return IntentAndTrade.model_validate_json(response.text)
+            
+        except Exception as e:
+            logger.error("Extraction Error: %s", e, exc_info=True)
+            return None
+
+
+    async def warmup(self) -> None:
+        """
+        Primes Gemini's implicit prompt cache with the static extraction prefix,
+        so the first real request doesn't pay the cold prefill.
+        Calls the API directly: no retries, and a failure doesn't count against
+        the circuit breaker. Failures are logged and ignored.
+        """
+        try:
+            await self._generate(**self._extraction_request("warmup"))
+        except Exception as e:
+            logger.warning("Gemini warmup failed: %s", e)
+
+
+    def _build_chat_request(
+        self,
+        user_message: str,
+        chat_history: List[Message],
+        trade_history: List[Dict[str, Any]],
+        session_id: Optional[str] = None,
+        intent: Optional[str] = None,
+    ):
+        """Builds (contents, config) shared by the blocking and streaming chat paths."""
+        # Intent from the router, else whatever extraction already cached for this text
+        intent = intent or self.intent_cache.peek(user_message)
+
+        trade_context = "No previous trades available."
+        if not needs_trade_context(intent):
+            trade_context = OMITTED_CONTEXT
+        elif trade_history or session_id:
+            # Compact tail, precomputed per session (or memoized) instead of per turn
+            trade_context = session_trade_context(session_id, trade_history)
+
+        # Build Chat Context from the dicts prebuilt on each Message, packed to a token budget.
+        # Trade history goes in its own turn just before the latest message.
+        contents = [msg.content_dict for msg in pack_history(chat_history)]
+        contents.append({"role": "user", "parts": [{"text": f"[CONTEXT]\n{trade_context}"}]})
+        contents.append({"role": "user", "parts": [{"text": user_message}]})
+
+        return contents, _CHAT_CONFIG
+
+
+    @staticmethod
+    def _is_grounded(response) -> bool:
+        """True if Google Search grounding was used for this response/chunk."""
+        if response.candidates and response.candidates[0].grounding_metadata:
+            # Updated check for the new SDK structure
+            return getattr(response.candidates[0].grounding_metadata, 'search_entry_point', None) is not None
+        return False
 
 
     async def generate_chat_response(
@@ -144,102 +365,99 @@ class AIService:
         user_message: str, 
         chat_history: List[Message], 
         trade_history: List[Dict[str, Any]],
+        session_id: Optional[str] = None,
+        intent: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         Generates chat response.
         CRITICAL: Forces neutral response for logging to allow backend confirmation.
         """
-        MAX_RETRIES = 3
-        
-        trade_context = "No previous trades available."
-        if trade_history:
-            # Limit history to save tokens
-            trade_context = json.dumps(trade_history[-15:], indent=2, default=str)
-
-        system_instruction = f"""
-        You are an expert Trading Journal AI Assistant (Gemini).
-
-        [DATA SOURCES]
-        1. **Internal Trade History:** {trade_context}
-        2. **Google Search Tool:** (Use for real-time news/prices)
-
-        [PROTOCOL]
-        - **NEWS/MARKET:** You MUST use the `Google Search` tool.
-        - **ANALYSIS:** Analyze the Internal Trade History.
-        - **LOGGING A TRADE:** If the user says "I bought..." or "Log this...", provide a **neutral, short acknowledgment** (e.g., "Understood," "Processing entry," or "Got it").
-          **IMPORTANT:** DO NOT confirm the trade details (price, ticker) yourself. The system will auto-generate the confirmation message.
-        """
+        contents, config = self._build_chat_request(user_message, chat_history, trade_history, session_id, intent)
 
-        # Build Chat Context
-        contents = []
-        for msg in chat_history[-6:]:
-            role = "model" if msg.role == "assistant" else "user"
-            contents.append(types.Content(role=role, parts=[types.Part(text=msg.content)]))
-        
-        contents.append(types.Content(role="user", parts=[types.Part(text=user_message)]))
+        try:
+            response = await self._call(
+                model=self.model_id,
+                contents=contents,
+                config=config,
+            )
+
+            # Check for Grounding (Search usage)
+            is_grounded = self._is_grounded(response)
+            
+            # --- FIX: Better Text Extraction Logic ---
+            message_text = ""
+            
+            # 1. Try direct text property (Standard success path)
+            if response.text:
+                message_text = response.text
+            
+            # 2. Try candidates list if text property is empty (common with search results sometimes)
+            elif response.candidates and response.candidates[0].content.parts:
+                 # Loop through parts to find text
+                 for part in response.candidates[0].content.parts:
+                     if part.text:
+                         message_text += part.text
+            
+            # 3. Check if blocked by safety filters
+            elif response.prompt_feedback and response.prompt_feedback.block_reason:
+                 message_text = f"I cannot answer that request. (Safety Block: {response.prompt_feedback.block_reason})"
+
+            # 4. Last Resort - Detailed error if still empty
+            if not message_text:
+                logger.warning("Empty Response Debug: %s", response) # Full response for debugging
+                message_text = "I processed your request but could not generate a text response. Please try rephrasing."
+
+            return {
+                "message": message_text,
+                "is_grounded": is_grounded
+            }
         
-        fallback_msg = "I apologize, but my market intelligence service is overloaded right now. Please try again in a moment."
+        except Exception as e:
+            # Retries exhausted, circuit open, or a non-transient error
+            logger.error("Chat Final Error: %s", e, exc_info=True)
+            return {"message": _CHAT_FALLBACK_MSG, "is_grounded": False}
 
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = await self.client.aio.models.generate_content(
+
+    async def stream_chat_response(
+        self,
+        user_message: str,
+        chat_history: List[Message],
+        trade_history: List[Dict[str, Any]],
+        session_id: Optional[str] = None,
+        intent: Optional[str] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Streams the chat reply as text chunks for low time-to-first-byte.
+        The final item is a sentinel dict: {"is_grounded": bool, "done": True}.
+        Non-streaming consumers should keep using generate_chat_response.
+        """
+        contents, config = self._build_chat_request(user_message, chat_history, trade_history, session_id, intent)
+        is_grounded = False
+        emitted_text = False
+
+        try:
+            # Streams aren't retried mid-way, but they still feed the breaker
+            self.breaker.check()
+            async with self._sem:
+                stream = await self.client.aio.models.generate_content_stream(
                     model=self.model_id,
                     contents=contents,
-                    config=types.GenerateContentConfig(
-                        system_instruction=system_instruction,
-                        tools=[types.Tool(google_search=types.GoogleSearch())], 
-                        temperature=0.7,
-                    )
+                    config=config,
                 )
+                async for chunk in stream:
+                    # Grounding metadata typically arrives on the final chunk
+                    is_grounded = is_grounded or self._is_grounded(chunk)
+                    if chunk.text:
+                        emitted_text = True
+                        yield chunk.text
+            self.breaker.record_success()
+        except Exception as e:
+            self.breaker.record_error(e)
+            logger.error("Chat Stream Error: %s", e, exc_info=True)
+            if not emitted_text:
+                yield _CHAT_FALLBACK_MSG
 
-                # Check for Grounding (Search usage)
-                is_grounded = False
-                if response.candidates and response.candidates[0].grounding_metadata:
-                    # Updated check for the new SDK structure
-                    if hasattr(response.candidates[0].grounding_metadata, 'search_entry_point') and \
-                       response.candidates[0].grounding_metadata.search_entry_point is not None:
-                        is_grounded = True
-                
-                # --- FIX: Better Text Extraction Logic ---
-                message_text = ""
-                
-                # 1. Try direct text property (Standard success path)
-                if response.text:
-                    message_text = response.text
-                
-                # 2. Try candidates list if text property is empty (common with search results sometimes)
-                elif response.candidates and response.candidates[0].content.parts:
-                     # Loop through parts to find text
-                     for part in response.candidates[0].content.parts:
-                         if part.text:
-                             message_text += part.text
-                
-                # 3. Check if blocked by safety filters
-                elif response.prompt_feedback and response.prompt_feedback.block_reason:
-                     message_text = f"I cannot answer that request. (Safety Block: {response.prompt_feedback.block_reason})"
-
-                # 4. Last Resort - Detailed error if still empty
-                if not message_text:
-                    print(f"⚠️ Empty Response Debug: {response}") # Print full response to logs for debugging
-                    message_text = "I processed your request but could not generate a text response. Please try rephrasing."
-
-                return {
-                    "message": message_text,
-                    "is_grounded": is_grounded
-                }
-            
-            except APIError as e:
-                if "503" in str(e) and attempt < MAX_RETRIES - 1:
-                    print(f"Chat 503 Error. Retrying in {2 ** attempt}s...")
-                    await asyncio.sleep(2 ** attempt)
-                else:
-                    print(f"❌ Chat Final Error: {e}")
-                    return {"message": fallback_msg, "is_grounded": False}
-            except Exception as e:
-                print(f"❌ Chat Internal Error: {e}")
-                return {"message": fallback_msg, "is_grounded": False}
-        
-        return {"message": fallback_msg, "is_grounded": False}
+        yield {"is_grounded": is_grounded, "done": True}
 
 
     async def analyze_trades(self, trades: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -247,47 +465,31 @@ class AIService:
         if not trades:
             return {"summary": "No trades to analyze.", "insights": []}
             
-        prompt = f"""Analyze this trade data and return a JSON object with a 'summary' and a list of 'insights'.
-        Trades: {json.dumps(trades[:50], default=str)}
-        """
+        prompt = _ANALYSIS_PROMPT_PREFIX + orjson.dumps(trades[:50], default=str).decode()
         
         try:
-            class AnalysisResult(BaseModel):
-                summary: str
-                insights: List[str]
-
-            response = await self.client.aio.models.generate_content(
+            response = await self.batcher.submit(
                 model=self.model_id,
                 contents=prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=AnalysisResult
-                )
+                config=_ANALYSIS_CONFIG,
             )
-            return json.loads(response.text)
+            return orjson.loads(response.text)
         except Exception as e:
-            print(f"Analysis Error: {e}")
+            logger.warning("Analysis Error: %s", e, exc_info=True)
             return {"summary": "Analysis failed.", "insights": []}
 
     async def generate_title_for_chat(self, messages: List[Message]) -> Optional[str]:
         """Generates a short title for the chat session."""
         try:
-            # Using a simpler prompt construction
             context_text = "\n".join([f"{m.role}: {m.content}" for m in messages[-5:]])
-            prompt = f"Generate a 3-5 word title for this conversation. Return JSON: {{'title': '...'}}\n\n{context_text}"
-            
-            class TitleResult(BaseModel):
-                title: str
+            prompt = _TITLE_PROMPT_PREFIX + context_text
 
-            response = await self.client.aio.models.generate_content(
-                model=self.model_id,
+            response = await self.batcher.submit(
+                model=self.title_model_id,
                 contents=prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=TitleResult
-                )
+                config=_TITLE_CONFIG,
             )
-            data = json.loads(response.text)
+            data = orjson.loads(response.text)
             return data.get("title")
         except Exception:
             return "New Chat"
\ No newline at end of file
@@ -1,252 +1,454 @@
-import json
+import logging
 import os
+import orjson
 import asyncio
-from typing import Optional, Dict, Any, List
-from datetime import datetime
+import grpc
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, AsyncIterator
+from datetime import date
 from pydantic import BaseModel
 
 # --- Official xAI SDK Imports ---
-from xai_sdk import Client
-from xai_sdk.chat import system, user, assistant, tool_result
+from xai_sdk import AsyncClient
+from xai_sdk.chat import system, user, assistant, tool, tool_result
 
 # --- Local Imports ---
-from app.models import TradeCreate, Message
+from app.models import TradeCreate, Message, IntentAndTrade
 # Ensure you have created this file from the previous step!
-from app.news_api_tool import fetch_stock_news 
+from app.news_api_tool import FETCH_STOCK_NEWS_TOOL, fetch_stock_news
+from app.trade_context import OMITTED_CONTEXT, needs_trade_context, serialize_trades, session_trade_context
+from app.history import HISTORY_TOKEN_BUDGET, history_tokens, pack_history
+from app.intent_cache import SemanticIntentCache
+from app.resilience import CircuitBreaker
 
-class AIService:
+logger = logging.getLogger(__name__)
+
+# Static system prompt; the date and user text go in the user turn.
+_CLASSIFY_AND_EXTRACT_PROMPT = """
+You are a strict Trading Journal Classifier and Data Extraction Agent.
+
+Step 1: Classify the user's PRIMARY intent:
+LOG_TRADE (reporting a completed trade), REVIEW_ANALYSIS (past performance),
+NEWS_MARKET (prices/news), PLAN_STRATEGY (advice/planning), OTHER (general chat).
+
+Step 2: If intent == LOG_TRADE, also populate `trade`; else trade = null.
+Trade schema: ticker (str), entry_date (YYYY-MM-DD), entry_price (float), quantity (float),
+exit_date (YYYY-MM-DD, optional), exit_price (float, optional), notes (str, optional).
+Rules:
+- Default quantity to 1 if missing.
+- Use the Context Date when no date is mentioned.
+- Set trade = null if no valid trade is found.
+
+Return ONLY a JSON object: {"intent": "<CATEGORY>", "trade": {...} | null}
+"""
+
+# Byte-identical on every request so xAI's prefix cache can reuse it.
+SYSTEM_PROTOCOL = """
+You are an expert Trading AI (Grok).
+
+[DATA SOURCES]
+1. Internal History: provided in a [CONTEXT] message right before the latest user message.
+2. News Tool: Use `fetch_stock_news` for live market info.
+
+[PROTOCOL]
+- NEWS/MARKET: You MUST call the tool `fetch_stock_news`.
+- ANALYSIS: Use Internal History.
+- LOGGING: Be concise and confirming.
+
+[EXAMPLES]
+User: "I bought 20 AMD at 155 this morning"
+Assistant: "Noted."
+
+User: "What's moving NVDA today?"
+Assistant: (calls fetch_stock_news with query "NVDA", then summarizes the headlines)
+
+User: "What's my win rate on TSLA?"
+Assistant: (uses Internal History to count winning vs losing TSLA trades and reports the percentage)
+"""
+
+_MAX_CHAT_SESSIONS = 512
+_MAX_SESSION_TURNS = 20
+
+# --- Static One-Shot Prompts ---
+# Hoisted so each request reuses the same string (and the same cacheable prefix).
+_ANALYSIS_SYSTEM_PROMPT = "Return ONLY valid JSON: { 'summary': str, 'insights': [str] }"
+
+_ANALYSIS_PROMPT_PREFIX = (
+    "Analyze this trade data and return a JSON object with a 'summary' and a list of 'insights'.\n"
+    "Trades: "
+)
+
+_TITLE_PROMPT_PREFIX = (
+    "Generate a very short (3-5 words) title for this conversation. Return JSON: {'title': '...'}\n\n"
+    "Conversation:\n"
+)
+
+_CHAT_FALLBACK_MSG = "Grok service is currently unavailable."
+
+# The shared OpenAI-style schema, converted once to the SDK's tool proto.
+# xAI takes tools (and sampling params) when the chat is created, not per sample.
+_CHAT_TOOLS = (
+    tool(
+        name=FETCH_STOCK_NEWS_TOOL["function"]["name"],
+        description=FETCH_STOCK_NEWS_TOOL["function"]["description"],
+        parameters=FETCH_STOCK_NEWS_TOOL["function"]["parameters"],
+    ),
+)
+
+# gRPC statuses that mean xAI itself is unhealthy; only these count against the breaker
+_TRANSIENT_CODES = frozenset({
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.INTERNAL,
+})
+
+def _is_transient(exc: BaseException) -> bool:
+    return isinstance(exc, grpc.aio.AioRpcError) and exc.code() in _TRANSIENT_CODES
+
+async def _run_news_tool(arguments: str) -> str:
+    """Executes one fetch_stock_news tool call from its raw JSON arguments."""
+    args = orjson.loads(arguments)
+    return await fetch_stock_news(args["query"])
+
+class _ChatSession:
+    """A reusable xAI chat for one conversation, serialized by its own lock."""
+
+    def __init__(self):
+        self.chat = None
+        self.trade_context: Optional[str] = None
+        self.turns = 0
+        # len(chat_history) the next turn must arrive with for the chat to be current
+        self.history_len = 0
+        # Index into chat_history of the oldest message the chat holds
+        self.history_start = 0
+        self.lock = asyncio.Lock()
+
+class GrokService:
     """
     Drop-in replacement for AIService using xAI's Grok.
-    Implements Sequential Classification and Tool Use via xai-sdk.
+    Implements Combined Classification/Extraction and Tool Use via xai-sdk.
     """
 
+    _instance: Optional["GrokService"] = None
+
     def __init__(self):
         api_key = os.environ.get("XAI_API_KEY")
         if not api_key:
             raise ValueError("XAI_API_KEY is missing. Cannot initialize Grok client.")
         
-        # Initialize the official xAI Client
-        self.client = Client(api_key=api_key)
+        # Async xAI client: sync sampling would block the event loop and serialize gather()
+        self.client = AsyncClient(api_key=api_key)
         
         # 'grok-beta' is currently the standard API model
         self.MODEL_ID = "grok-beta" 
 
-    async def classify_intent(self, text: str) -> str:
+        # Per-conversation chat objects, reused across turns (LRU-bounded)
+        self._chat_sessions: "OrderedDict[str, _ChatSession]" = OrderedDict()
+
+        # Fails fast to the fallback while xAI is down (the SDK already retries transient gRPC errors)
+        self.breaker = CircuitBreaker("grok", fail_max=5, reset_timeout=30, is_failure=_is_transient)
+
+        # Intents seen for repeat/near-duplicate phrasings let extraction skip the LLM
+        self.intent_cache = SemanticIntentCache(
+            db_path=os.environ.get("INTENT_CACHE_DB", "intent_cache_grok.db")
+        )
+
+    @classmethod
+    def get(cls) -> "GrokService":
+        """Process-wide singleton so every request shares one client."""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    async def _sample(self, chat):
+        """Circuit-broken chat.sample used by every Grok call (sampling params are set on create)."""
+        return await self.breaker.call(chat.sample)
+
+    async def warmup(self) -> None:
         """
-        STAGE 1: Fast classification of user intent.
+        Samples one extraction at startup so its prompt prefix is cached.
+        Samples directly: a failure doesn't count against the circuit breaker.
         """
         try:
-            # Create a standalone chat session for classification
-            chat = self.client.chat.create(model=self.MODEL_ID)
-            
-            chat.append(system(
-                "You are a classifier. Determine the PRIMARY intent of the input.\n"
-                "Categories: LOG_TRADE, REVIEW_ANALYSIS, NEWS_MARKET, PLAN_STRATEGY, OTHER.\n"
-                "Return ONLY a JSON object: {\"intent\": \"CATEGORY\"}"
-            ))
-            chat.append(user(text))
-            
-            # Low temperature for deterministic JSON
-            response = chat.sample(temperature=0.0)
-            
-            # Clean potential markdown wrappers (```json ... ```) if Grok adds them
-            content = response.content.strip()
-            if content.startswith("```"):
-                content = content.split("```")[1].replace("json", "").strip()
-
-            data = json.loads(content)
-            return data.get("intent", "OTHER").upper()
+            await self._extraction_chat("warmup").sample()
         except Exception as e:
-            print(f"⚠️ Grok Classification Error: {e}")
-            return "OTHER"
+            logger.warning("Grok warmup failed: %s", e)
+
+    def _extraction_chat(self, text: str):
+        """Standalone chat for the fused classification + extraction call."""
+        today = date.today().isoformat()
+        chat = self.client.chat.create(model=self.MODEL_ID, temperature=0.0, response_format="json_object")
+        chat.append(system(_CLASSIFY_AND_EXTRACT_PROMPT))
+        chat.append(user(f"Context Date: {today}\nUser Input: \"{text}\""))
+        return chat
 
     async def extract_trade_from_text(self, text: str) -> Optional[TradeCreate]:
         """
-        STAGE 2: Extract trade data only if intent is LOG_TRADE.
+        STAGE 2: Classify + extract in ONE call.
+        Returns the trade only if intent is LOG_TRADE.
         """
-        
-        # 1. Check Intent
-        intent = await self.classify_intent(text)
-        if intent != "LOG_TRADE":
+        # A cached non-trade intent (exact or near-duplicate) means there is nothing to extract
+        cached_intent = await self.intent_cache.lookup(text)
+        if cached_intent is not None and cached_intent != "LOG_TRADE":
             return None
 
-        # 2. Perform Extraction
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        chat = self.client.chat.create(model=self.MODEL_ID)
-        chat.append(system(
-            "You are a strict Data Extraction Agent. Your job is to extract trade details into JSON.\n"
-            "Schema: ticker (str), entry_price (float), quantity (float), action (buy/sell), etc.\n"
-            "Rules:\n"
-            "- Return valid JSON matching the schema.\n"
-            "- Default quantity to 1 if missing.\n"
-            "- Return the string 'null' if no valid trade is found."
-        ))
-        
-        user_prompt = f"""
-        Context Date: {today}
-        User Input: "{text}"
-        
-        Extract the trade details JSON:
-        """
-        chat.append(user(user_prompt))
-
         try:
-            response = chat.sample(temperature=0.0)
+            response = await self._sample(self._extraction_chat(text))
             content = response.content.strip()
             
             # Clean markdown if present
             if content.startswith("```"):
                 content = content.split("```")[1].replace("json", "").strip()
 
-            if "null" not in content.lower():
-                return TradeCreate.model_validate_json(content)
-            return None
+            result = IntentAndTrade.model_validate_json(content)
+            await self.intent_cache.remember(text, result.intent)
+            return result.trade if result.intent == "LOG_TRADE" else None
             
         except Exception as e:
-            print(f"❌ Grok Extraction Error: {e}")
+            logger.error("Grok Extraction Error: %s", e, exc_info=True)
             return None
 
+    def _new_chat(
+        self,
+        packed_history: List[Message],
+        trade_context: str,
+        session_id: Optional[str],
+    ):
+        """Creates a chat seeded with the static protocol, packed recent history and trade context."""
+        # conversation_id sets x-grok-conv-id so turns of one session hit the same prompt cache
+        chat = self.client.chat.create(
+            model=self.MODEL_ID,
+            conversation_id=session_id,
+            tools=_CHAT_TOOLS,
+            temperature=0.7,
+        )
+        chat.append(system(SYSTEM_PROTOCOL))
+        
+        # Recent turns, already packed to the history token budget
+        for m in packed_history:
+            if m.role == "user":
+                chat.append(user(m.content))
+            else:
+                chat.append(assistant(m.content))
+        
+        # Per-user trade context as its own turn, after the static prefix
+        chat.append(user(f"[CONTEXT]\n{trade_context}"))
+        return chat
+
+    def _get_session(self, session_id: str) -> _ChatSession:
+        session = self._chat_sessions.get(session_id)
+        if session is None:
+            session = _ChatSession()
+            self._chat_sessions[session_id] = session
+            if len(self._chat_sessions) > _MAX_CHAT_SESSIONS:
+                self._chat_sessions.popitem(last=False)
+        self._chat_sessions.move_to_end(session_id)
+        return session
+
+    @asynccontextmanager
+    async def _chat_turn(
+        self,
+        user_message: str,
+        chat_history: List[Message],
+        trade_history: List[Dict[str, Any]],
+        session_id: Optional[str],
+        intent: Optional[str] = None,
+    ):
+        """
+        Yields a chat ready to sample the next reply.
+        With a session_id, the chat object is kept between turns so only the new
+        user message is appended and the server-side prompt cache stays warm.
+        Sessions are per worker process: if turns were served elsewhere (the
+        history length doesn't match), the chat is rebuilt from chat_history.
+        It is also rebuilt (re-packed) once the turns it holds outgrow the
+        history token budget.
+        """
+        # Intent from the router, else whatever extraction already cached for this text
+        intent = intent or self.intent_cache.peek(user_message)
+
+        # Intent first, so skipped turns never serialize the trades
+        if not needs_trade_context(intent):
+            trade_context = OMITTED_CONTEXT
+        elif session_id:
+            # Rolling context precomputed on the trade write path
+            trade_context = session_trade_context(session_id, trade_history)
+        else:
+            trade_context = serialize_trades(trade_history, limit=20) if trade_history else "No history."
+
+        if not session_id:
+            chat = self._new_chat(pack_history(chat_history), trade_context, None)
+            chat.append(user(user_message))
+            yield chat
+            return
+
+        session = self._get_session(session_id)
+        async with session.lock:
+            # Rebuild when the chat missed turns or outgrew the token budget, and
+            # periodically so a long-lived session can't grow without bound
+            if (
+                session.chat is None
+                or session.history_len != len(chat_history)
+                or session.turns >= _MAX_SESSION_TURNS
+                or history_tokens(chat_history[session.history_start:]) > HISTORY_TOKEN_BUDGET
+            ):
+                packed = pack_history(chat_history)
+                session.chat = self._new_chat(packed, trade_context, session_id)
+                session.trade_context = trade_context
+                session.turns = 0
+                session.history_start = len(chat_history) - len(packed)
+            elif trade_context != OMITTED_CONTEXT and session.trade_context != trade_context:
+                # An omitted turn leaves the session's last real context in place
+                session.chat.append(user(f"[CONTEXT]\n{trade_context}"))
+                session.trade_context = trade_context
+
+            session.chat.append(user(user_message))
+            session.turns += 1
+            # The next request's chat_history adds this message and the reply
+            session.history_len = len(chat_history) + 2
+
+            try:
+                yield session.chat
+            except BaseException:
+                # History may be half-applied; start clean next turn
+                session.chat = None
+                raise
+
+    async def _append_tool_results(self, chat, response) -> None:
+        """Runs the response's tool calls concurrently and appends the results to `chat`."""
+        # Add Grok's request-to-call-tool message to history
+        chat.append(response)
+
+        # Failures become per-call error payloads
+        calls = [c for c in response.tool_calls if c.function.name == "fetch_stock_news"]
+        results = await asyncio.gather(
+            *(_run_news_tool(c.function.arguments) for c in calls),
+            return_exceptions=True,
+        )
+        for call, result in zip(calls, results):
+            if isinstance(result, Exception):
+                result = orjson.dumps({"error": str(result)}).decode()
+            # Add result back to chat, in the order Grok requested them
+            chat.append(tool_result(result, tool_call_id=call.id))
+
     async def generate_chat_response(
         self, 
         user_message: str, 
         chat_history: List[Message], 
         trade_history: List[Dict[str, Any]],
+        session_id: Optional[str] = None,
+        intent: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         Generates chat response using Grok.
         Handles Tool Calling for 'fetch_stock_news'.
         """
-        
-        trade_context = json.dumps(trade_history[-20:], indent=2, default=str) if trade_history else "No history."
+        try:
+            async with self._chat_turn(user_message, chat_history, trade_history, session_id, intent) as chat:
+                # First Sample (Model decides to use tool or not); tools were set in _new_chat
+                response = await self._sample(chat)
+                is_grounded = bool(response.tool_calls)
 
-        system_instruction = f"""
-        You are an expert Trading AI (Grok).
-        
-        [DATA SOURCES]
-        1. Internal History: {trade_context}
-        2. News Tool: Use `fetch_stock_news` for live market info.
-
-        [PROTOCOL]
-        - NEWS/MARKET: You MUST call the tool `fetch_stock_news`.
-        - ANALYSIS: Use Internal History.
-        - LOGGING: Be concise and confirming.
-        """
+                if is_grounded:
+                    await self._append_tool_results(chat, response)
+                    # Final Sample (Grok answers using the tool data)
+                    response = await self._sample(chat)
+
+                chat.append(response)
+                return {"message": response.content, "is_grounded": is_grounded}
 
-        # 1. Define Tools (xAI SDK format)
-        tools = [{
-            "type": "function",
-            "function": {
-                "name": "fetch_stock_news",
-                "description": "Get live news for a stock ticker.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "Ticker symbol (e.g. AAPL)"}
-                    },
-                    "required": ["query"]
-                }
-            }
-        }]
+        except Exception as e:
+            logger.error("Grok Chat Error: %s", e, exc_info=True)
+            # Fallback if Grok API fails
+            return {"message": _CHAT_FALLBACK_MSG, "is_grounded": False}
+
+    async def stream_chat_response(
+        self,
+        user_message: str,
+        chat_history: List[Message],
+        trade_history: List[Dict[str, Any]],
+        session_id: Optional[str] = None,
+        intent: Optional[str] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Streams the chat reply as text chunks for low time-to-first-byte.
+        The final item is a sentinel dict: {"is_grounded": bool, "done": True}.
+        """
+        is_grounded = False
+        emitted_text = False
 
         try:
-            # 2. Initialize Chat & Build History
-            chat = self.client.chat.create(model=self.MODEL_ID)
-            chat.append(system(system_instruction))
-            
-            for m in chat_history[-6:]:
-                if m.role == "user":
-                    chat.append(user(m.content))
-                else:
-                    chat.append(assistant(m.content))
-            
-            chat.append(user(user_message))
+            # Streams bypass _sample, so they feed the breaker directly
+            self.breaker.check()
+            async with self._chat_turn(user_message, chat_history, trade_history, session_id, intent) as chat:
+                # chat.stream() yields (accumulated response, chunk) pairs
+                response = None
+                async for response, chunk in chat.stream():
+                    if chunk.content:
+                        emitted_text = True
+                        yield chunk.content
 
-            # 3. First Sample (Model decides to use tool or not)
-            # Note: In xAI SDK, tools are passed here
-            response = chat.sample(tools=tools, temperature=0.7)
-            
-            is_grounded = False
-
-            # 4. Handle Tool Calls
-            if response.tool_calls:
-                is_grounded = True
-                # Add Grok's request-to-call-tool message to history
-                chat.append(response) 
-
-                for call in response.tool_calls:
-                    if call.function.name == "fetch_stock_news":
-                        try:
-                            # Parse arguments
-                            args = json.loads(call.function.arguments)
-                            # Execute Python function
-                            news_result = await fetch_stock_news(args["query"])
-                            
-                            # Add result back to chat
-                            chat.append(tool_result(
-                                tool_call_id=call.id,
-                                content=news_result
-                            ))
-                        except Exception as tool_err:
-                             chat.append(tool_result(
-                                tool_call_id=call.id,
-                                content=json.dumps({"error": str(tool_err)})
-                            ))
-
-                # 5. Final Sample (Grok answers using the tool data)
-                final_response = chat.sample(tools=tools, temperature=0.7)
-                return {"message": final_response.content, "is_grounded": True}
-
-            # Case: No tool used
-            return {"message": response.content, "is_grounded": False}
+                if response is None:
+                    raise RuntimeError("Grok returned an empty stream")
+                if response.tool_calls:
+                    is_grounded = True
+                    await self._append_tool_results(chat, response)
+                    async for response, chunk in chat.stream():
+                        if chunk.content:
+                            emitted_text = True
+                            yield chunk.content
+
+                chat.append(response)
+            self.breaker.record_success()
 
         except Exception as e:
-            print(f"❌ Grok Chat Error: {e}")
-            # Fallback if Grok API fails
-            return {"message": "Grok service is currently unavailable.", "is_grounded": False}
+            self.breaker.record_error(e)
+            logger.error("Grok Chat Stream Error: %s", e, exc_info=True)
+            if not emitted_text:
+                yield _CHAT_FALLBACK_MSG
+
+        yield {"is_grounded": is_grounded, "done": True}
 
     async def analyze_trades(self, trades: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Generates analysis insights."""
         if not trades:
             return {"summary": "No trades to analyze.", "insights": []}
             
-        prompt = f"""Analyze this trade data and return a JSON object with a 'summary' and a list of 'insights'.
-        Trades: {json.dumps(trades[:50], default=str)}
-        """
+        prompt = _ANALYSIS_PROMPT_PREFIX + orjson.dumps(trades[:50], default=str).decode()
         
         try:
-            chat = self.client.chat.create(model=self.MODEL_ID)
-            chat.append(system("Return ONLY valid JSON: { 'summary': str, 'insights': [str] }"))
+            chat = self.client.chat.create(model=self.MODEL_ID, temperature=0.1)
+            chat.append(system(_ANALYSIS_SYSTEM_PROMPT))
             chat.append(user(prompt))
             
-            response = chat.sample(temperature=0.1)
+            response = await self._sample(chat)
             
             # Clean potential markdown
             content = response.content.strip()
             if content.startswith("```"):
                 content = content.split("```")[1].replace("json", "").strip()
 
-            return json.loads(content)
+            return orjson.loads(content)
         except Exception as e:
-            print(f"Analysis Error: {e}")
+            logger.warning("Analysis Error: %s", e, exc_info=True)
             return {"summary": "Analysis failed.", "insights": []}
 
     async def generate_title_for_chat(self, messages: List[Message]) -> Optional[str]:
         """Generates a short title."""
-        prompt = "Generate a very short (3-5 words) title for this conversation. Return JSON: {'title': '...'}"
         context = "\n".join([f"{m.role}: {m.content}" for m in messages[-5:]])
         
         try:
-            chat = self.client.chat.create(model=self.MODEL_ID)
-            chat.append(user(f"{prompt}\n\nConversation:\n{context}"))
+            chat = self.client.chat.create(model=self.MODEL_ID, temperature=0.3, max_tokens=32)
+            chat.append(user(_TITLE_PROMPT_PREFIX + context))
             
-            response = chat.sample(temperature=0.3)
+            response = await self._sample(chat)
             
             content = response.content.strip()
             if content.startswith("```"):
                 content = content.split("```")[1].replace("json", "").strip()
                 
-            data = json.loads(content)
+            data = orjson.loads(content)
             return data.get("title")
         except Exception:
             return "New Chat"
\ No newline at end of file
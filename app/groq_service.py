@@ -1,169 +1,263 @@
-import json
+import logging
 import os
+import orjson
 import asyncio
-from typing import Optional, Dict, Any, List
-from datetime import datetime
+from typing import Optional, Dict, Any, List, AsyncIterator
+from datetime import date
 
 # --- Official Groq SDK ---
-from groq import AsyncGroq
+from groq import AsyncGroq, APIConnectionError, APIStatusError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 # --- Local Imports ---
-from app.models import TradeCreate, Message
-from app.news_api_tool import fetch_stock_news
+from app.models import TradeCreate, Message, IntentAndTrade
+from app.news_api_tool import TOOLS, fetch_stock_news
+from app.trade_context import OMITTED_CONTEXT, needs_trade_context, serialize_trades, session_trade_context
+from app.history import pack_history
+from app.intent_cache import SemanticIntentCache
+from app.http_client import SHARED_HTTPX
+from app.resilience import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Static system prompt: the per-request date lives in the user turn so this
+# prefix is byte-identical across requests (and cacheable by the provider).
+_CLASSIFY_AND_EXTRACT_PROMPT = """
+You are a strict Trading Journal Classifier and Data Extraction Agent.
+
+Step 1: Classify the user's PRIMARY intent:
+LOG_TRADE (reporting a completed trade), REVIEW_ANALYSIS (past performance),
+NEWS_MARKET (prices/news), PLAN_STRATEGY (advice/planning), OTHER (general chat).
+
+Step 2: If intent == LOG_TRADE, also populate `trade`; else trade = null.
+Trade schema: ticker (str), entry_date (YYYY-MM-DD), entry_price (float), quantity (float),
+exit_date (YYYY-MM-DD, optional), exit_price (float, optional), notes (str, optional).
+Rules:
+- Default quantity to 1 if missing.
+- Use the Context Date when no date is mentioned.
+- Set trade = null if no valid trade is found.
+
+Return VALID JSON only: {"intent": "<CATEGORY>", "trade": {...} | null}
+"""
+
+# --- FIX: Added GENERAL/OTHER protocol to prevent "Copy that" loop ---
+# Byte-identical on every request so the provider's prefix cache can reuse it.
+SYSTEM_PROTOCOL = """
+You are an expert Trading AI running on Groq.
+
+[DATA SOURCES]
+1. History: provided in a [CONTEXT] message right before the latest user message.
+2. Tools: `fetch_stock_news` for live data.
+
+[PROTOCOL]
+- NEWS/MARKET: You MUST call `fetch_stock_news`.
+- ANALYSIS: Use History.
+- LOGGING: Provide a neutral, short acknowledgment (e.g., "Copy that"). DO NOT confirm details.
+- GENERAL/OTHER: Respond naturally, helpfully, and conversationally to greetings or questions.
+
+[EXAMPLES]
+User: "I bought 20 AMD at 155 this morning"
+Assistant: "Copy that."
+
+User: "What's moving NVDA today?"
+Assistant: (calls fetch_stock_news with query "NVDA", then summarizes the headlines)
+
+User: "What's my win rate on TSLA?"
+Assistant: (uses History to count winning vs losing TSLA trades and reports the percentage)
+
+User: "Hey, how's it going?"
+Assistant: "Doing well! Want to review your trades or check the market?"
+"""
+
+# --- Static One-Shot Prompts ---
+# Hoisted so each request reuses the same string (and the same cacheable prefix).
+_ANALYSIS_PROMPT = "Return JSON: { 'summary': str, 'insights': [str] }"
+
+_TITLE_PROMPT = "Return JSON: {'title': '3-5 word title'}"
+
+_CHAT_FALLBACK_MSG = "Groq service is currently unavailable. Please try again."
+
+# Rate limits, overload and dropped connections are worth retrying
+_RETRYABLE_CODES = {429, 500, 502, 503}
+
+def _is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, APIConnectionError):
+        return True
+    return isinstance(exc, APIStatusError) and exc.status_code in _RETRYABLE_CODES
+
+async def _run_news_tool(arguments: str) -> str:
+    """Executes one fetch_stock_news tool call from its raw JSON arguments."""
+    args = orjson.loads(arguments)
+    return await fetch_stock_news(args["query"])
 
 class GroqService:
     """
     AI Service utilizing Groq LPU (Llama 3 Models).
     """
 
+    _instance: Optional["GroqService"] = None
+
     def __init__(self):
         api_key = os.environ.get("GROQ_API_KEY")
         if not api_key:
             raise ValueError("GROQ_API_KEY is missing. Cannot initialize Groq client.")
         
-        self.client = AsyncGroq(api_key=api_key)
+        # Reuse the worker-wide HTTP/2 pool instead of a per-SDK one.
+        # SDK retries are off: _complete retries with jitter and feeds the breaker.
+        self.client = AsyncGroq(api_key=api_key, http_client=SHARED_HTTPX, max_retries=0)
         self.FAST_MODEL = "llama-3.1-8b-instant"
         self.SMART_MODEL = "llama-3.3-70b-versatile"
 
-    async def classify_intent(self, text: str) -> str:
-        """STAGE 1: Fast classification."""
-        prompt = f"""
-        You are a classifier. Determine the PRIMARY intent of the input.
-        Categories: LOG_TRADE, REVIEW_ANALYSIS, NEWS_MARKET, PLAN_STRATEGY, OTHER.
-        Return ONLY a JSON object: {{"intent": "CATEGORY"}}
-        Input: "{text}"
+        # Fails fast to the fallback while Groq is down instead of retrying every request
+        self.breaker = CircuitBreaker("groq", fail_max=5, reset_timeout=30, is_failure=_is_transient)
+
+        # Intents seen for repeat/near-duplicate phrasings let extraction skip the LLM
+        self.intent_cache = SemanticIntentCache(
+            db_path=os.environ.get("INTENT_CACHE_DB", "intent_cache_groq.db")
+        )
+
+    @classmethod
+    def get(cls) -> "GroqService":
+        """Process-wide singleton so every request shares one client."""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential_jitter(initial=0.5, max=4),
+        retry=retry_if_exception(_is_transient),
+        reraise=True,
+    )
+    async def _complete_with_retry(self, **kwargs):
+        return await self.client.chat.completions.create(**kwargs)
+
+    async def _complete(self, **kwargs):
+        """Retried, circuit-broken chat completion used by every Groq call."""
+        return await self.breaker.call(self._complete_with_retry, **kwargs)
+
+    async def warmup(self) -> None:
+        """
+        Sends one extraction request at startup so its prompt prefix is cached.
+        Calls the API directly: no retries, and a failure doesn't count against
+        the circuit breaker.
         """
-        
         try:
-            response = await self.client.chat.completions.create(
-                model=self.FAST_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                response_format={"type": "json_object"},
-                temperature=0.0,
-                max_tokens=50
-            )
-            content = response.choices[0].message.content
-            data = json.loads(content)
-            return data.get("intent", "OTHER").upper()
+            await self.client.chat.completions.create(**self._extraction_request("warmup"))
         except Exception as e:
-            print(f"Groq Classification Warning: {e}")
-            return "OTHER"
+            logger.warning("Groq warmup failed: %s", e)
+
+    def _extraction_request(self, text: str) -> Dict[str, Any]:
+        """Completion kwargs for the fused classification + extraction call."""
+        today = date.today().isoformat()
+        return {
+            "model": self.SMART_MODEL,
+            "messages": [
+                {"role": "system", "content": _CLASSIFY_AND_EXTRACT_PROMPT},
+                {"role": "user", "content": f"Context Date: {today}\nUser Input: {text}"}
+            ],
+            "response_format": {"type": "json_object"},
+            "temperature": 0.0,
+        }
 
     async def extract_trade_from_text(self, text: str) -> Optional[TradeCreate]:
-        """STAGE 2: Extract trade data."""
-        intent = await self.classify_intent(text)
-        if intent != "LOG_TRADE":
+        """
+        STAGE 2: Classify + extract in ONE call.
+        Returns the trade only if intent is LOG_TRADE.
+        """
+        # A cached non-trade intent (exact or near-duplicate) means there is nothing to extract
+        cached_intent = await self.intent_cache.lookup(text)
+        if cached_intent is not None and cached_intent != "LOG_TRADE":
             return None
 
-        today = datetime.now().strftime('%Y-%m-%d')
-        system_msg = f"""
-        You are a strict Data Extraction Agent. Context Date: {today}.
-        Extract the COMPLETED trade details into JSON.
-        Schema matches TradeCreate (ticker, entry_price, quantity, etc).
-        Rules:
-        - Return VALID JSON only.
-        - Default quantity to 1 if missing.
-        - If no valid trade is found, return JSON: {{"error": "null"}}
-        """
-        
         try:
-            response = await self.client.chat.completions.create(
-                model=self.SMART_MODEL,
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": text}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.0
-            )
-            content = response.choices[0].message.content
-            if "null" in content.lower() and "error" in content.lower():
-                return None
-            return TradeCreate.model_validate_json(content)
+            response = await self._complete(**self._extraction_request(text))
+            result = IntentAndTrade.model_validate_json(response.choices[0].message.content)
+            await self.intent_cache.remember(text, result.intent)
+            return result.trade if result.intent == "LOG_TRADE" else None
         except Exception as e:
-            print(f"Groq Extraction Error: {e}")
+            logger.error("Groq Extraction Error: %s", e, exc_info=True)
             return None
 
+    def _build_chat_messages(
+        self,
+        user_message: str,
+        chat_history: List[Message],
+        trade_history: List[Dict[str, Any]],
+        session_id: Optional[str] = None,
+        intent: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Assembles the chat prompt shared by the streaming and non-streaming paths."""
+        # Intent from the router, else whatever extraction already cached for this text
+        intent = intent or self.intent_cache.peek(user_message)
+
+        # Intent first, so skipped turns never serialize the trades
+        if not needs_trade_context(intent):
+            trade_context = OMITTED_CONTEXT
+        elif session_id:
+            # Rolling context precomputed on the trade write path
+            trade_context = session_trade_context(session_id, trade_history)
+        else:
+            trade_context = serialize_trades(trade_history, limit=15) if trade_history else "No history."
+        
+        # Static protocol first (cacheable prefix), then history, then the
+        # per-user trade context as its own turn right before the latest message
+        messages = [{"role": "system", "content": SYSTEM_PROTOCOL}]
+        for m in pack_history(chat_history):
+            messages.append({"role": m.role, "content": m.content})
+        messages.append({"role": "user", "content": f"[CONTEXT]\n{trade_context}"})
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    async def _append_tool_results(self, messages: List[Dict[str, Any]], calls: List[tuple]) -> None:
+        """Runs (id, name, arguments) tool calls concurrently and appends their results in order."""
+        calls = [c for c in calls if c[1] == "fetch_stock_news"]
+        # Failures become per-call error payloads
+        results = await asyncio.gather(
+            *(_run_news_tool(arguments) for _, _, arguments in calls),
+            return_exceptions=True,
+        )
+        for (call_id, _, _), result in zip(calls, results):
+            if isinstance(result, Exception):
+                result = orjson.dumps({"error": str(result)}).decode()
+            messages.append({
+                "role": "tool",
+                "tool_call_id": call_id,
+                "content": result
+            })
+
     async def generate_chat_response(
         self, 
         user_message: str, 
         chat_history: List[Message], 
         trade_history: List[Dict[str, Any]],
+        session_id: Optional[str] = None,
+        intent: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         Generates chat response using Groq.
         """
-        
-        trade_context = json.dumps(trade_history[-15:], indent=2, default=str) if trade_history else "No history."
-        
-        # --- FIX: Added GENERAL/OTHER protocol to prevent "Copy that" loop ---
-        system_instruction = f"""
-        You are an expert Trading AI running on Groq.
-        
-        [DATA SOURCES]
-        1. History: {trade_context}
-        2. Tools: `fetch_stock_news` for live data.
-
-        [PROTOCOL]
-        - NEWS/MARKET: You MUST call `fetch_stock_news`.
-        - ANALYSIS: Use History.
-        - LOGGING: Provide a neutral, short acknowledgment (e.g., "Copy that"). DO NOT confirm details.
-        - GENERAL/OTHER: Respond naturally, helpfully, and conversationally to greetings or questions.
-        """
-
-        messages = [{"role": "system", "content": system_instruction}]
-        for m in chat_history[-6:]:
-            messages.append({"role": m.role, "content": m.content})
-        messages.append({"role": "user", "content": user_message})
-
-        tools = [{
-            "type": "function",
-            "function": {
-                "name": "fetch_stock_news",
-                "description": "Get live news for a stock ticker.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "Ticker symbol (e.g. AAPL)"}
-                    },
-                    "required": ["query"]
-                }
-            }
-        }]
+        messages = self._build_chat_messages(user_message, chat_history, trade_history, session_id, intent)
 
         try:
-            response = await self.client.chat.completions.create(
+            response = await self._complete(
                 model=self.SMART_MODEL,
                 messages=messages,
-                tools=tools,
+                tools=TOOLS,
                 tool_choice="auto",
                 temperature=0.6
             )
             
             msg = response.choices[0].message
-            is_grounded = False
 
             if msg.tool_calls:
-                is_grounded = True
                 messages.append(msg)
-                for tool_call in msg.tool_calls:
-                    if tool_call.function.name == "fetch_stock_news":
-                        try:
-                            args = json.loads(tool_call.function.arguments)
-                            news_result = await fetch_stock_news(args["query"])
-                            messages.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call.id,
-                                "content": news_result
-                            })
-                        except Exception as tool_err:
-                             messages.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call.id,
-                                "content": json.dumps({"error": str(tool_err)})
-                            })
-
-                final_response = await self.client.chat.completions.create(
+                await self._append_tool_results(
+                    messages,
+                    [(tc.id, tc.function.name, tc.function.arguments) for tc in msg.tool_calls],
+                )
+
+                final_response = await self._complete(
                     model=self.SMART_MODEL,
                     messages=messages
                 )
@@ -172,44 +266,115 @@ class GroqService:
             return {"message": msg.content, "is_grounded": False}
 
         except Exception as e:
-            print(f"Groq Chat Error: {e}")
+            logger.error("Groq Chat Error: %s", e, exc_info=True)
             return {
-                "message": "Groq service is currently unavailable. Please try again.", 
+                "message": _CHAT_FALLBACK_MSG, 
                 "is_grounded": False
             }
 
+    async def stream_chat_response(
+        self,
+        user_message: str,
+        chat_history: List[Message],
+        trade_history: List[Dict[str, Any]],
+        session_id: Optional[str] = None,
+        intent: Optional[str] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Streams the chat reply as text chunks for low time-to-first-byte.
+        The final item is a sentinel dict: {"is_grounded": bool, "done": True}.
+        """
+        messages = self._build_chat_messages(user_message, chat_history, trade_history, session_id, intent)
+        is_grounded = False
+        emitted_text = False
+
+        try:
+            stream = await self._complete(
+                model=self.SMART_MODEL,
+                messages=messages,
+                tools=TOOLS,
+                tool_choice="auto",
+                temperature=0.6,
+                stream=True
+            )
+
+            # Tool calls arrive as deltas; stitch them back together by index
+            tool_calls: Dict[int, Dict[str, str]] = {}
+            async for chunk in stream:
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    emitted_text = True
+                    yield delta.content
+                for tc in delta.tool_calls or []:
+                    call = tool_calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+                    call["id"] = tc.id or call["id"]
+                    if tc.function:
+                        call["name"] += tc.function.name or ""
+                        call["arguments"] += tc.function.arguments or ""
+
+            if tool_calls:
+                is_grounded = True
+                calls = [tool_calls[i] for i in sorted(tool_calls)]
+                messages.append({
+                    "role": "assistant",
+                    "tool_calls": [
+                        {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+                        for c in calls
+                    ],
+                })
+                await self._append_tool_results(messages, [(c["id"], c["name"], c["arguments"]) for c in calls])
+
+                stream = await self._complete(
+                    model=self.SMART_MODEL,
+                    messages=messages,
+                    stream=True
+                )
+                async for chunk in stream:
+                    text = chunk.choices[0].delta.content
+                    if text:
+                        emitted_text = True
+                        yield text
+
+        except Exception as e:
+            logger.error("Groq Chat Stream Error: %s", e, exc_info=True)
+            if not emitted_text:
+                yield _CHAT_FALLBACK_MSG
+
+        yield {"is_grounded": is_grounded, "done": True}
+
     async def analyze_trades(self, trades: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Generates analysis insights."""
         if not trades:
             return {"summary": "No trades.", "insights": []}
         
         try:
-            response = await self.client.chat.completions.create(
+            response = await self._complete(
                 model=self.SMART_MODEL,
                 messages=[
-                    {"role": "system", "content": "Return JSON: { 'summary': str, 'insights': [str] }"},
-                    {"role": "user", "content": f"Analyze: {json.dumps(trades[:50], default=str)}"}
+                    {"role": "system", "content": _ANALYSIS_PROMPT},
+                    {"role": "user", "content": f"Analyze: {orjson.dumps(trades[:50], default=str).decode()}"}
                 ],
                 response_format={"type": "json_object"}
             )
-            return json.loads(response.choices[0].message.content)
+            return orjson.loads(response.choices[0].message.content)
         except Exception as e:
-            print(f"Analysis Error: {e}")
+            logger.warning("Analysis Error: %s", e, exc_info=True)
             return {"summary": "Analysis failed.", "insights": []}
 
     async def generate_title_for_chat(self, messages: List[Message]) -> Optional[str]:
         """Generates a short title."""
         try:
             context = "\n".join([f"{m.role}: {m.content}" for m in messages[-5:]])
-            response = await self.client.chat.completions.create(
+            response = await self._complete(
                 model=self.FAST_MODEL,
                 messages=[
-                    {"role": "system", "content": "Return JSON: {'title': '3-5 word title'}"},
+                    {"role": "system", "content": _TITLE_PROMPT},
                     {"role": "user", "content": context}
                 ],
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                max_tokens=32
             )
-            data = json.loads(response.choices[0].message.content)
+            data = orjson.loads(response.choices[0].message.content)
             return data.get("title", "New Chat")
         except Exception:
             return "New Chat"
\ No newline at end of file
@@ -0,0 +1,49 @@
+import os
+from typing import List
+
+from app.models import Message
+
+# --- Optional Tokenizer ---
+# tiktoken's cl100k_base is only an approximation for Gemini/Llama/Grok,
+# which is fine for budgeting. Without it we fall back to ~4 chars per token.
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "2048"))
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _message_tokens(message: Message) -> int:
+    # Counted once per message, then cached on the instance
+    if message._token_count is None:
+        message._token_count = count_tokens(message.content)
+    return message._token_count
+
+
+def history_tokens(messages: List[Message]) -> int:
+    """Total token count of `messages`."""
+    return sum(_message_tokens(m) for m in messages)
+
+
+def pack_history(messages: List[Message], budget_tokens: int = HISTORY_TOKEN_BUDGET) -> List[Message]:
+    """Returns the longest recent suffix of `messages` that fits in `budget_tokens`."""
+    used = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        used += _message_tokens(messages[i])
+        if used > budget_tokens:
+            break
+        start = i
+    return messages[start:]
@@ -0,0 +1,14 @@
+import httpx
+
+# --- Shared HTTP Connection Pool ---
+# One HTTP/2 pool per worker, passed as the client itself (not copied limits)
+# to the Gemini and Groq SDKs, so concurrent LLM requests multiplex over warm
+# TLS connections instead of each SDK client opening its own.
+_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+SHARED_HTTPX = httpx.AsyncClient(http2=True, limits=_LIMITS, timeout=30.0)
+
+
+async def aclose_shared_client() -> None:
+    """Closes the shared pool on shutdown."""
+    await SHARED_HTTPX.aclose()
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bound on embeddings held between a lookup() miss and its remember()
+_MAX_MISS_EMBEDDINGS = 256
+
+# --- Optional Semantic Tier ---
+# numpy + sentence-transformers are only needed for near-duplicate matching.
+# Without them the cache still serves exact (normalized) repeats.
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    np = None
+    SentenceTransformer = None
+
+
+class SemanticIntentCache:
+    """
+    Two-tier cache of intents learned from the fused extraction call, so a
+    repeat non-trade message skips extraction.
+    - Tier 1: LRU of normalized text hash -> intent (exact repeats).
+    - Tier 2: cosine similarity over MiniLM embeddings (near-duplicate phrasings).
+    Entries expire after `ttl_seconds` and are persisted to a small SQLite file
+    so the cache survives restarts.
+    The SQLite file may be shared by several worker processes (WAL mode);
+    writes run in a worker thread so lock waits never stall the event loop.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_entries: int = 10_000,
+        ttl_seconds: float = 3600,
+        similarity_threshold: float = 0.92,
+        model_name: str = "all-MiniLM-L6-v2",
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.model_name = model_name
+
+        # Tier 1: exact match, key -> (intent, stored_at)
+        self._exact: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+        # Embeddings computed by lookup() misses, reused by the remember() that follows
+        self._miss_embeddings: "OrderedDict[str, Any]" = OrderedDict()
+
+        # Tier 2: ring buffer of L2-normalized embeddings + parallel intent list
+        self._semantic_enabled = np is not None and SentenceTransformer is not None
+        self._model = None
+        self._matrix = None
+        self._row_intents: List[str] = []
+        self._row_times: List[float] = []
+        self._next_row = 0
+
+        self._db = None
+        # Writes happen off the loop, so the connection is shared with worker threads
+        self._db_lock = threading.Lock()
+        self._writes: "set[asyncio.Task]" = set()
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            # WAL lets other workers read while one of them writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS intent_cache ("
+                "key TEXT PRIMARY KEY, intent TEXT NOT NULL, embedding BLOB, created_at REAL NOT NULL)"
+            )
+            self._load()
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return text.strip().lower()
+
+    @classmethod
+    def _key(cls, text: str) -> str:
+        return hashlib.blake2b(cls._normalize(text).encode(), digest_size=16).hexdigest()
+
+    def _is_fresh(self, stored_at: float) -> bool:
+        return time.time() - stored_at < self.ttl_seconds
+
+    async def lookup(self, text: str) -> Optional[str]:
+        """Exact tier, then near-duplicate phrasings. Never calls the provider."""
+        key = self._key(text)
+        cached = self._get_exact(key)
+        if cached is not None:
+            return cached
+
+        embedding = await self._embed(text)
+        if embedding is None:
+            return None
+        cached = self._nearest(embedding)
+        if cached is not None:
+            self._put_exact(key, cached)
+            return cached
+
+        self._miss_embeddings[key] = embedding
+        if len(self._miss_embeddings) > _MAX_MISS_EMBEDDINGS:
+            self._miss_embeddings.popitem(last=False)
+        return None
+
+    def peek(self, text: str) -> Optional[str]:
+        """Exact-tier lookup only (no embedding, no API call)."""
+        return self._get_exact(self._key(text))
+
+    async def remember(self, text: str, intent: str) -> None:
+        """Records an intent learned elsewhere (e.g. the fused extraction call)."""
+        key = self._key(text)
+        embedding = self._miss_embeddings.pop(key, None)
+        if self._get_exact(key) == intent:
+            return
+        if embedding is None:
+            embedding = await self._embed(text)
+        self._store(key, embedding, intent)
+
+    # --- Tier 1 ---
+
+    def _get_exact(self, key: str) -> Optional[str]:
+        entry = self._exact.get(key)
+        if entry is None:
+            return None
+        if not self._is_fresh(entry[1]):
+            del self._exact[key]
+            return None
+        self._exact.move_to_end(key)
+        return entry[0]
+
+    def _put_exact(self, key: str, intent: str, stored_at: Optional[float] = None) -> None:
+        self._exact[key] = (intent, stored_at or time.time())
+        self._exact.move_to_end(key)
+        if len(self._exact) > self.max_entries:
+            self._exact.popitem(last=False)
+
+    # --- Tier 2 ---
+
+    async def _embed(self, text: str):
+        """Embeds off the event loop; returns None when the semantic tier is unavailable."""
+        if not self._semantic_enabled:
+            return None
+        try:
+            return await asyncio.to_thread(self._embed_sync, self._normalize(text))
+        except Exception as e:
+            logger.warning("Intent cache embedding disabled: %s", e, exc_info=True)
+            self._semantic_enabled = False
+            return None
+
+    def _embed_sync(self, text: str):
+        if self._model is None:
+            self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+    def _nearest(self, embedding) -> Optional[str]:
+        if self._matrix is None or not self._row_intents:
+            return None
+        scores = self._matrix[: len(self._row_intents)] @ embedding
+        best = int(scores.argmax())
+        if scores[best] >= self.similarity_threshold and self._is_fresh(self._row_times[best]):
+            return self._row_intents[best]
+        return None
+
+    def _put_semantic(self, embedding, intent: str, stored_at: Optional[float] = None) -> None:
+        if self._matrix is None:
+            self._matrix = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+        self._matrix[self._next_row] = embedding
+        stored_at = stored_at or time.time()
+        if self._next_row < len(self._row_intents):
+            self._row_intents[self._next_row] = intent
+            self._row_times[self._next_row] = stored_at
+        else:
+            self._row_intents.append(intent)
+            self._row_times.append(stored_at)
+        self._next_row = (self._next_row + 1) % self.max_entries
+
+    # --- Persistence ---
+
+    def _store(self, key: str, embedding, intent: str) -> None:
+        self._put_exact(key, intent)
+        if embedding is not None:
+            self._put_semantic(embedding, intent)
+
+        if self._db is not None:
+            blob = embedding.tobytes() if embedding is not None else None
+            # Fire-and-forget: the in-memory tiers are already updated, so
+            # callers never wait on the disk write
+            task = asyncio.create_task(asyncio.to_thread(self._write_row, key, intent, blob, time.time()))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    def _write_row(self, key: str, intent: str, blob: Optional[bytes], created_at: float) -> None:
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO intent_cache (key, intent, embedding, created_at) VALUES (?, ?, ?, ?)",
+                    (key, intent, blob, created_at),
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning("Intent cache write failed: %s", e, exc_info=True)
+
+    def _load(self) -> None:
+        rows = self._db.execute(
+            "SELECT key, intent, embedding, created_at FROM intent_cache "
+            "WHERE created_at > ? ORDER BY created_at DESC LIMIT ?",
+            (time.time() - self.ttl_seconds, self.max_entries),
+        ).fetchall()
+
+        # Oldest first so the LRU order matches insertion order
+        for key, intent, blob, created_at in reversed(rows):
+            self._put_exact(key, intent, created_at)
+            if blob is not None and self._semantic_enabled:
+                self._put_semantic(np.frombuffer(blob, dtype=np.float32), intent, created_at)
@@ -0,0 +1,36 @@
+import logging
+import logging.handlers
+import os
+import queue
+from typing import Optional
+
+# --- Non-Blocking Logging ---
+# Request handlers only enqueue records; a background thread does the
+# actual stderr writes, so error storms never stall the event loop on I/O.
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """Routes the root logger through a QueueHandler. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level or os.environ.get("LOG_LEVEL", "INFO"))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,57 +1,121 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Literal, Dict, Any
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, PrivateAttr
+from typing import Annotated, Optional, List, Literal, Dict, Any
 from datetime import date
 
 # --- Core Models (Mirrored from main backend for contract consistency) ---
+# All models are frozen: they're read-only once validated. Response models
+# also forbid extra keys so their serializer schema stays minimal.
+
+def _parse_iso_date(value: Any) -> Any:
+    # LLMs emit YYYY-MM-DD; the C fromisoformat is the fast path for that.
+    # Anything else falls through to pydantic's general date parser.
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            pass
+    return value
+
+IsoDate = Annotated[date, BeforeValidator(_parse_iso_date)]
 
 class TradeCreate(BaseModel):
     """Data structure for a full trade record."""
+    model_config = ConfigDict(frozen=True)
+
     ticker: str
-    entry_date: date
+    entry_date: IsoDate
     entry_price: float
     quantity: float
-    exit_date: Optional[date] = None
+    exit_date: Optional[IsoDate] = None
     exit_price: Optional[float] = None
     notes: Optional[str] = None
 
+Intent = Literal["LOG_TRADE", "REVIEW_ANALYSIS", "NEWS_MARKET", "PLAN_STRATEGY", "OTHER"]
+
+class IntentAndTrade(BaseModel):
+    """Combined classification + extraction result (one LLM call instead of two)."""
+    model_config = ConfigDict(frozen=True)
+
+    intent: Intent
+    trade: Optional[TradeCreate] = None
+
 class Message(BaseModel):
     """Simplified message model for chat context."""
+    model_config = ConfigDict(frozen=True)
+
     role: Literal['user', 'assistant']
     content: str
+
+    # Gemini-ready content dict, built once at construction (the SDK accepts plain dicts)
+    _content_dict: Dict[str, Any] = PrivateAttr(default=None)
+    # Token count, filled in lazily by app.history.pack_history
+    _token_count: Optional[int] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        role = "model" if self.role == "assistant" else "user"
+        self._content_dict = {"role": role, "parts": [{"text": self.content}]}
+
+    @property
+    def content_dict(self) -> Dict[str, Any]:
+        return self._content_dict
     
 # --- Request Models (Inputs from Main Backend) ---
 
 class ChatProcessRequest(BaseModel):
     """Request to process a chat message with full history context."""
+    model_config = ConfigDict(frozen=True)
+
     user_message: str
     chat_history: List[Message] = Field(default_factory=list)
     trade_history: List[Dict[str, Any]] = Field(default_factory=list)
+    session_id: Optional[str] = None # Enables the precomputed per-session trade context
+    intent: Optional[Intent] = None # Upstream classification; trade context is skipped when irrelevant
 
 class TradeExtractionRequest(BaseModel):
     """Request to extract a trade from raw text."""
+    model_config = ConfigDict(frozen=True)
+
     text: str
 
+class TradeContextUpdateRequest(BaseModel):
+    """Notifies the service that a trade was recorded for a chat session."""
+    model_config = ConfigDict(frozen=True)
+
+    session_id: str
+    trade: Dict[str, Any]
+
 class TradeAnalysisRequest(BaseModel):
     """Request to generate insights from trades."""
+    model_config = ConfigDict(frozen=True)
+
     trades: List[Dict[str, Any]]
 
 class TitleGenerationRequest(BaseModel):
     """Request to generate a chat title from messages."""
+    model_config = ConfigDict(frozen=True)
+
     messages: List[Message]
+    session_id: Optional[str] = None # Titles are cached per session when provided
 
 # --- Response Models (Outputs to Main Backend) ---
 
 class AIMessageResponse(BaseModel):
     """AI chat response (with optional extracted trade)."""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     message: str
     trade_extracted: Optional[TradeCreate] = None
     is_grounded: bool = False # ADDED: Flag to indicate if external tool/search was used
 
 class InsightsResponse(BaseModel):
     """AI insights response."""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     summary: str
     insights: List[str]
 
 class TitleResponse(BaseModel):
     """AI generated title response."""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     title: str
\ No newline at end of file
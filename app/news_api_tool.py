@@ -1,14 +1,103 @@
+import logging
 import httpx
 import os
-import json
-from typing import List, Dict, Any
+import time
+import orjson
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 # Define the base URL for a simple news fetching service (e.g., NewsAPI or a wrapper)
 NEWS_API_ENDPOINT = "https://newsapi.org/v2/everything"
 NEWS_API_KEY = os.environ.get("NEWS_API_KEY")
 
 if not NEWS_API_KEY:
-    print("WARNING: NEWS_API_KEY is not set. Groq news tool will not function.")
+    logger.warning("NEWS_API_KEY is not set. News tool will not function.")
+
+# Process-wide keep-alive client: news calls reuse warm HTTP/2 connections
+# instead of paying a TCP + TLS handshake every time. The key travels as a header.
+_CLIENT = httpx.AsyncClient(
+    timeout=10,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+    headers={"X-Api-Key": NEWS_API_KEY} if NEWS_API_KEY else None,
+)
+
+# Query params that never change, built once. Only q and pageSize vary per call.
+# Results are restricted to specific financial sources for relevance.
+_BASE_PARAMS = (
+    ("language", "en"),
+    ("sortBy", "publishedAt"),
+    ("sources", "financial-times,reuters,bloomberg"),
+)
+
+
+async def aclose_client() -> None:
+    """Closes the news client on shutdown."""
+    await _CLIENT.aclose()
+
+# --- Tool Schema ---
+# Shared by the Groq and Grok chat paths. Defined once so the schema bytes are
+# identical on every request (tool definitions are part of the prompt prefix).
+FETCH_STOCK_NEWS_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "fetch_stock_news",
+        "description": "Get live news for a stock ticker.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Ticker symbol (e.g. AAPL)"}
+            },
+            "required": ["query"]
+        }
+    }
+}
+
+TOOLS = (FETCH_STOCK_NEWS_TOOL,)
+
+# Static error payloads, serialized once
+_ERR_NO_KEY = orjson.dumps({"error": "News API Key is missing. Cannot fetch real-time news."}).decode()
+# Upstream failures by HTTP status, so the model can tell a bad key from a rate limit
+_ERR_BY_STATUS = {
+    code: orjson.dumps({"error": f"News API service error ({code}): {reason}."}).decode()
+    for code, reason in (
+        (400, "bad request"),
+        (401, "invalid or missing API key"),
+        (426, "plan does not allow this request"),
+        (429, "rate limited, try again later"),
+        (500, "server error"),
+        (503, "service unavailable"),
+    )
+}
+_ERR_INTERNAL = orjson.dumps({"error": "An internal error occurred while reaching the News API."}).decode()
+
+# --- Response Cache ---
+# News moves by the minute, so repeat lookups within a conversation are served
+# from memory. Keyed by (query.lower(), limit) -> (fetched_at, payload); only
+# successful fetches are cached.
+_CACHE_TTL_SECONDS = 60
+_CACHE_MAX_ENTRIES = 256
+_cache: "OrderedDict[Tuple[str, int], Tuple[float, str]]" = OrderedDict()
+
+
+def _cache_get(key: Tuple[str, int]) -> Optional[str]:
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] >= _CACHE_TTL_SECONDS:
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return entry[1]
+
+
+def _cache_put(key: Tuple[str, int], payload: str) -> None:
+    _cache[key] = (time.monotonic(), payload)
+    _cache.move_to_end(key)
+    if len(_cache) > _CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
 
 async def fetch_stock_news(query: str, limit: int = 3) -> str:
     """
@@ -16,46 +105,45 @@ async def fetch_stock_news(query: str, limit: int = 3) -> str:
     This function is designed to be called by the Groq model.
     """
     if not NEWS_API_KEY:
-        return json.dumps({"error": "News API Key is missing. Cannot fetch real-time news."})
-
-    # Restrict the query to specific financial sources for relevance
-    # Example: Financial Times, Reuters, Bloomberg
-    sources = "financial-times,reuters,bloomberg"
-    
-    params = {
-        'q': query,
-        'apiKey': NEWS_API_KEY,
-        'pageSize': limit,
-        'language': 'en',
-        'sortBy': 'publishedAt',
-        'sources': sources
-    }
+        return _ERR_NO_KEY
+
+    cache_key = (query.strip().lower(), limit)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    params = (("q", query), ("pageSize", limit), *_BASE_PARAMS)
 
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(NEWS_API_ENDPOINT, params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            
-            if data['status'] != 'ok' or not data['articles']:
-                return json.dumps({"error": f"No recent news found for query: {query}"})
-
-            # Format the articles concisely for the LLM
-            formatted_articles = []
-            for article in data['articles']:
-                formatted_articles.append({
-                    "title": article.get('title'),
-                    "source": article.get('source', {}).get('name'),
-                    "description": article.get('description'),
-                    "published_at": article.get('publishedAt')
-                })
-            
-            return json.dumps({"articles": formatted_articles})
-
-    except httpx.HTTPStatusError as e:
-        print(f"HTTP Error fetching news: {e.response.status_code}")
-        return json.dumps({"error": f"News API service error ({e.response.status_code})."})
+        response = await _CLIENT.get(NEWS_API_ENDPOINT, params=params)
+        # Checked up front rather than via raise_for_status: a bad status is
+        # an expected outcome here, not worth an exception round-trip
+        if not response.is_success:
+            logger.warning("HTTP Error fetching news: %s", response.status_code)
+            return _ERR_BY_STATUS.get(response.status_code) or orjson.dumps(
+                {"error": f"News API service error ({response.status_code})."}
+            ).decode()
+
+        data = orjson.loads(response.content)
+        
+        if data['status'] != 'ok' or not data['articles']:
+            return orjson.dumps({"error": f"No recent news found for query: {query}"}).decode()
+
+        # Format the articles concisely for the LLM
+        formatted_articles = [
+            {
+                "title": a.get('title'),
+                "source": (a.get('source') or {}).get('name'),
+                "description": a.get('description'),
+                "published_at": a.get('publishedAt')
+            }
+            for a in data['articles']
+        ]
+        
+        payload = orjson.dumps({"articles": formatted_articles}).decode()
+        _cache_put(cache_key, payload)
+        return payload
+
     except Exception as e:
-        print(f"General Error fetching news: {e}")
-        return json.dumps({"error": "An internal error occurred while reaching the News API."})
\ No newline at end of file
+        logger.warning("General Error fetching news: %s", e, exc_info=True)
+        return _ERR_INTERNAL
\ No newline at end of file
@@ -0,0 +1,24 @@
+import re
+
+# --- Trade Prefilter ---
+# A trade report needs a trade verb/noun (or a price/size marker such as
+# "@ 150", "at 150" or "155 x 20") AND a number (price/quantity).
+# Inputs failing this cheap check never reach the LLM, so the vocabulary errs
+# wide: a false positive costs one extraction call, a false negative a lost trade.
+_TRADE_HINT = re.compile(
+    r"\b(?:"
+    r"buy(?:s|ing)?|bought|sell(?:s|ing)?|sold|purchas(?:e|es|ed|ing)"
+    r"|add(?:s|ed|ing)?|open(?:s|ed|ing)?|clos(?:e|es|ed|ing)|cover(?:s|ed|ing)?"
+    r"|trim(?:s|med|ming)?|scal(?:e|es|ed|ing)\s+(?:in|out)|enter(?:s|ed|ing)?|exit(?:s|ed|ing)?"
+    r"|(?:got|get|getting)\s+(?:in|into|out)|took|grabbed|picked\s+up|loaded|dumped|unloaded"
+    r"|long|short(?:s|ed|ing)?|shares?|contracts?|calls?|puts?|fill(?:s|ed)?|traded"
+    r")\b"
+    r"|@|\d\s*x\s*\d|\bat\s*\$?\d",
+    re.IGNORECASE,
+)
+_NUM = re.compile(r"\d")
+
+
+def may_contain_trade(text: str) -> bool:
+    """False for obvious non-trades ("hi", "thanks", "what is NVDA doing?")."""
+    return bool(_TRADE_HINT.search(text) and _NUM.search(text))
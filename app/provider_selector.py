@@ -1,44 +1,50 @@
-  
 # ai-microservice/app/provider_selector.py
 
 import os
+import logging
+import importlib
 from dotenv import load_dotenv
 load_dotenv()
+
+logger = logging.getLogger(__name__)
+
 # Since main.py loads .env early, we can read the variable here
 # Use a default of 'gemini' if not specified
 AI_PROVIDER = os.environ.get("AI_PROVIDER", "gemini").lower() 
 
-# --- IMPORTANT: We need to import the actual implementation classes ---
-
-# Note: The original ai_service.py is assumed to be renamed to gemini_service.py 
-# in a complete modular structure, but for simplicity, we will create aliases.
-
-if AI_PROVIDER == "grok":
-    from .grok_service import GrokService as AIService
-    print("🤖 AI Provider Selected: Grok (xAI)")
-    
-elif AI_PROVIDER == "gemini":
-    # The original file, which you currently have as 'ai_service.py', 
-    # needs to be renamed or treated as the Gemini implementation.
-    # For this demonstration, we assume you have renamed your current ai_service.py to gemini_service.py.
-    # If not, you must rename your current ai_service.py to gemini_service.py manually.
-    from .gemini_service import AIService as AIService 
-    print("🤖 AI Provider Selected: Gemini")
-
-elif AI_PROVIDER == "groq":
-    from .groq_service import GroqService as AIService
-    print("🤖 AI Provider Selected: Groq (Llama 3 Models)")
-    
-else:
-    # Fallback to a class that raises an error if the config is bad
-    class PlaceholderService:
-        def __init__(self):
-            raise ValueError(f"Invalid AI_PROVIDER '{AI_PROVIDER}' set in environment.")
-        # Define necessary async methods to prevent runtime errors
-        async def extract_trade_from_text(self, *args): return None
-        async def generate_chat_response(self, *args): return {"message": "Service Not Configured.", "is_grounded": False}
-        async def analyze_trades(self, *args): return {"summary": "Service Not Configured.", "insights": []}
-        async def generate_title_for_chat(self, *args): return "Error"
-        
+# --- Provider Dispatch Table ---
+# "module:Class" per provider. Only the selected module is imported, so the
+# other SDKs (grpc/protobuf for xAI, etc.) never load.
+_PROVIDERS = {
+    "grok": ("app.grok_service:GrokService", "Grok (xAI)"),
+    "gemini": ("app.gemini_service:AIService", "Gemini"),
+    "groq": ("app.groq_service:GroqService", "Groq (Llama 3 Models)"),
+}
+
+
+# Fallback to a class that raises an error if the config is bad
+class PlaceholderService:
+    def __init__(self):
+        raise ValueError(f"Invalid AI_PROVIDER '{AI_PROVIDER}' set in environment.")
+    @classmethod
+    def get(cls): return cls()
+    # Define necessary async methods to prevent runtime errors
+    async def warmup(self): return None
+    async def extract_trade_from_text(self, *args): return None
+    async def generate_chat_response(self, *args, **kwargs): return {"message": "Service Not Configured.", "is_grounded": False}
+    async def stream_chat_response(self, *args, **kwargs):
+        yield "Service Not Configured."
+        yield {"is_grounded": False, "done": True}
+    async def analyze_trades(self, *args): return {"summary": "Service Not Configured.", "insights": []}
+    async def generate_title_for_chat(self, *args): return "Error"
+
+
+_entry = _PROVIDERS.get(AI_PROVIDER)
+if _entry is None:
     AIService = PlaceholderService
-    print(f"❌ AI Provider Error: '{AI_PROVIDER}' is not a valid provider. Check AI_PROVIDER variable.")
\ No newline at end of file
+    logger.error("AI Provider Error: '%s' is not a valid provider. Check AI_PROVIDER variable.", AI_PROVIDER)
+else:
+    _target, _label = _entry
+    _module_name, _class_name = _target.split(":")
+    AIService = getattr(importlib.import_module(_module_name), _class_name)
+    logger.info("AI Provider Selected: %s", _label)
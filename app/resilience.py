@@ -0,0 +1,69 @@
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+    After `fail_max` consecutive failures the circuit opens and calls fail fast
+    with CircuitOpenError for `reset_timeout` seconds. After that, calls go
+    through again: one success closes the circuit, one failure re-opens it.
+    Only errors matching `is_failure` (the provider's transient/provider-side
+    predicate) count, so a client's bad requests can't open the circuit for everyone.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fail_max: int = 5,
+        reset_timeout: float = 30,
+        is_failure: Optional[Callable[[BaseException], bool]] = None,
+    ):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._is_failure = is_failure
+        self._failures = 0
+        self._opened_at = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self._failures >= self.fail_max and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def check(self) -> None:
+        """Raises CircuitOpenError if calls should short-circuit to the fallback."""
+        if self.is_open:
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+    def record_success(self) -> None:
+        self._failures = 0
+
+    def record_error(self, exc: BaseException) -> None:
+        """Records a failure if `exc` is provider-side; other errors leave the count alone."""
+        if isinstance(exc, CircuitOpenError):
+            return
+        if self._is_failure is None or self._is_failure(exc):
+            self.record_failure()
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._failures >= self.fail_max:
+            # (Re)open: a failed trial call restarts the timeout
+            self._opened_at = time.monotonic()
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """Awaits `func(*args, **kwargs)` through the breaker."""
+        self.check()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as exc:
+            self.record_error(exc)
+            raise
+        self.record_success()
+        return result
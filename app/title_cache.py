@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.models import Message
+
+logger = logging.getLogger(__name__)
+
+TitleGenerator = Callable[[List[Message]], Awaitable[Optional[str]]]
+
+
+class TitleCache:
+    """
+    Per-session chat titles. A title rarely changes once set, so it is
+    generated once per session: either prefetched in the background while
+    the chat reply is produced, or on the first /ai/generate-title call.
+    A failed generation is remembered for `failure_ttl` seconds, so an
+    unhealthy provider isn't asked again on every chat turn.
+    """
+
+    def __init__(self, max_entries: int = 4096, min_messages: int = 3, failure_ttl: float = 60):
+        self.max_entries = max_entries
+        self.min_messages = min_messages
+        self.failure_ttl = failure_ttl
+        self._titles: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        # session_id -> monotonic time of the last failed generation
+        self._failed: "OrderedDict[str, float]" = OrderedDict()
+
+    def get(self, session_id: str) -> Optional[str]:
+        title = self._titles.get(session_id)
+        if title is not None:
+            self._titles.move_to_end(session_id)
+        return title
+
+    def _recently_failed(self, session_id: str) -> bool:
+        failed_at = self._failed.get(session_id)
+        if failed_at is None:
+            return False
+        if time.monotonic() - failed_at >= self.failure_ttl:
+            del self._failed[session_id]
+            return False
+        return True
+
+    def prefetch(self, session_id: Optional[str], messages: List[Message], generate: TitleGenerator) -> None:
+        """Starts title generation in the background once the session has enough context."""
+        if not session_id or len(messages) < self.min_messages:
+            return
+        if session_id in self._titles or session_id in self._pending or self._recently_failed(session_id):
+            return
+        self._start(session_id, messages, generate)
+
+    async def get_or_generate(
+        self, session_id: Optional[str], messages: List[Message], generate: TitleGenerator
+    ) -> Optional[str]:
+        """Returns the cached title, joins an in-flight prefetch, or generates one now."""
+        if not session_id:
+            return await generate(messages)
+
+        title = self.get(session_id)
+        if title is not None:
+            return title
+        if self._recently_failed(session_id):
+            return None
+
+        task = self._pending.get(session_id) or self._start(session_id, messages, generate)
+        # shield: a disconnecting caller must not cancel a generation others may join
+        return await asyncio.shield(task)
+
+    def _start(self, session_id: str, messages: List[Message], generate: TitleGenerator) -> asyncio.Task:
+        task = asyncio.create_task(self._generate(session_id, messages, generate))
+        self._pending[session_id] = task
+        return task
+
+    async def _generate(self, session_id: str, messages: List[Message], generate: TitleGenerator) -> Optional[str]:
+        try:
+            title = await generate(messages)
+        except Exception as e:
+            logger.warning("Title generation failed: %s", e, exc_info=True)
+            title = None
+        finally:
+            self._pending.pop(session_id, None)
+
+        # Fallback titles are only negatively cached, so a later call can do better
+        if not title or title == "New Chat":
+            self._failed[session_id] = time.monotonic()
+            self._failed.move_to_end(session_id)
+            if len(self._failed) > self.max_entries:
+                self._failed.popitem(last=False)
+            return title
+
+        self._failed.pop(session_id, None)
+        self._titles[session_id] = title
+        self._titles.move_to_end(session_id)
+        if len(self._titles) > self.max_entries:
+            self._titles.popitem(last=False)
+        return title
@@ -0,0 +1,76 @@
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import orjson
+
+
+def serialize_trades(trades: List[Dict[str, Any]], limit: int) -> str:
+    """
+    Compact JSON (no indent) of the last `limit` trades.
+    Not memoized: orjson renders a 15-20 trade tail in microseconds, and a
+    key cheap enough to be worth it can't tell users or edited trades apart.
+    """
+    if not trades:
+        return "[]"
+    return orjson.dumps(trades[-limit:], default=str).decode()
+
+
+# --- Intent Gating ---
+# Greetings, news questions and trade logging don't draw on past trades, so
+# those turns skip the history block entirely.
+_CONTEXT_FREE_INTENTS = frozenset({"NEWS_MARKET", "LOG_TRADE", "OTHER"})
+OMITTED_CONTEXT = "(omitted — not relevant)"
+
+
+def needs_trade_context(intent: Optional[str]) -> bool:
+    """False only when the intent is known and doesn't use trade history."""
+    return intent not in _CONTEXT_FREE_INTENTS
+
+
+# --- Per-Session Rolling Context ---
+# Write path: when the backend records a trade it pushes it here, and the
+# compact tail is re-rendered once. Chat turns then read the string directly
+# instead of re-serializing trade_history on every message.
+# The request's trade_history stays authoritative: an entry is only served
+# while its length and tail still match it, so a missed push or an edited
+# trade (e.g. closed with an exit_price) re-seeds instead of going stale.
+# Comparing dicts is much cheaper than re-encoding them.
+_SESSION_LIMIT = 15
+_SESSION_MAX_ENTRIES = 1024
+_sessions: "OrderedDict[str, Tuple[Deque[Dict[str, Any]], str, int]]" = OrderedDict()
+
+
+def _put_session(session_id: str, trades: Deque[Dict[str, Any]], history_len: int) -> str:
+    rendered = orjson.dumps(list(trades), default=str).decode()
+    _sessions[session_id] = (trades, rendered, history_len)
+    _sessions.move_to_end(session_id)
+    if len(_sessions) > _SESSION_MAX_ENTRIES:
+        _sessions.popitem(last=False)
+    return rendered
+
+
+def update_trade_context(session_id: str, trade: Dict[str, Any]) -> None:
+    """Appends a newly recorded trade to the session's rolling tail and re-renders it."""
+    entry = _sessions.get(session_id)
+    if entry is None:
+        # Not seeded on this worker yet; the next chat turn seeds from trade_history
+        return
+    trades, _, history_len = entry
+    trades.append(trade)
+    _put_session(session_id, trades, history_len + 1)
+
+
+def session_trade_context(session_id: Optional[str], trades: List[Dict[str, Any]]) -> str:
+    """
+    Returns the precomputed context for `session_id` if it still matches `trades`,
+    otherwise (re)seeds it from `trades`. Without a session id this just serializes.
+    """
+    if not session_id:
+        return serialize_trades(trades, limit=_SESSION_LIMIT)
+
+    tail = trades[-_SESSION_LIMIT:]
+    entry = _sessions.get(session_id)
+    if entry is not None and entry[2] == len(trades) and list(entry[0]) == tail:
+        _sessions.move_to_end(session_id)
+        return entry[1]
+    return _put_session(session_id, deque(tail, maxlen=_SESSION_LIMIT), len(trades))
@@ -2,127 +2,293 @@
 
 import uvicorn
 import os
+import logging
+import asyncio
+import orjson
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv 
-from fastapi import FastAPI, HTTPException, status
-from pydantic_settings import BaseSettings
-from typing import Optional
+from fastapi import FastAPI, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from types import SimpleNamespace
 
 # --- FIX: Environment Loading ---
 # Load .env file contents immediately to set variables for configuration
 load_dotenv() 
 
-# Import the final, selected AIService class from the selector file
-# This class will be either the GeminiService or the GrokService
+# Configure queue-based logging before the provider modules start logging
+from app.logging_setup import configure_logging, shutdown_logging
+configure_logging()
+log = logging.getLogger("ai_ms")
+
+# The single entrypoint: AIService is whichever provider AI_PROVIDER selects,
+# and only that provider's module (and SDK) is imported
 from app.provider_selector import AIService
 
 # Import Models (these are consistent across both services)
 from app.models import (
     AIMessageResponse, ChatProcessRequest, TradeExtractionRequest, 
     TradeAnalysisRequest, InsightsResponse, TitleGenerationRequest, 
-    TitleResponse, TradeCreate
+    TitleResponse, TradeCreate, TradeContextUpdateRequest, Message
 )
+from app.trade_context import update_trade_context
+from app.http_client import aclose_shared_client
+from app.news_api_tool import aclose_client as aclose_news_client
+from app.title_cache import TitleCache
+from app.prefilter import may_contain_trade
 
 # --- Configuration Loader ---
 
-class Settings(BaseSettings):
-    HOST: str = "0.0.0.0"
-    PORT: int = 8001
-    
-    # Keys are checked here for Pydantic validation, but actual client config happens inside AIService
-    GEMINI_API_KEY: Optional[str] = None
-    XAI_API_KEY: Optional[str] = None 
-    GROQ_API_KEY: Optional[str] = None
-    
-settings = Settings()
+# Plain env reads: a handful of values doesn't need pydantic-settings.
+# Keys are listed for visibility; actual client config happens inside AIService.
+settings = SimpleNamespace(
+    HOST=os.environ.get("HOST", "0.0.0.0"),
+    PORT=int(os.environ.get("PORT", "8001")),
+    GEMINI_API_KEY=os.environ.get("GEMINI_API_KEY"),
+    XAI_API_KEY=os.environ.get("XAI_API_KEY"),
+    GROQ_API_KEY=os.environ.get("GROQ_API_KEY"),
+)
 
 # --- Instantiate the Selected Service ---
 try:
-    # This initializes the chosen AI service (Gemini or Grok) after configs are loaded
-    ai_service = AIService()
+    # This initializes the chosen AI service (Gemini or Grok) after configs are loaded.
+    # get() returns a process-wide singleton, so the SDK client and its connection
+    # pool are created once at startup and reused by every request.
+    ai_service = AIService.get()
     
     # This simple attribute lets the health check report the current provider name
     # We use __name__ to get the actual class name (e.g., 'AIService', 'GrokService')
     service_name = AIService.__name__
+
+    # Bound once so the hot endpoints do a single global lookup per call
+    _gen_chat = ai_service.generate_chat_response
+    _stream_chat = ai_service.stream_chat_response
+    _extract = ai_service.extract_trade_from_text
+    _analyze = ai_service.analyze_trades
+    _gen_title = ai_service.generate_title_for_chat
     
-except Exception as e:
-    print(f"❌ FATAL CONFIG ERROR: Could not initialize AI service: {e}")
+except Exception:
+    log.exception("FATAL CONFIG ERROR: Could not initialize AI service")
+    shutdown_logging() # flush the queue; os._exit skips atexit handlers
     os._exit(1) # Exit cleanly if service initialization fails
 
-app = FastAPI(title="AI Microservice (Multi-Model)", version="2.1.0")
+# Titles are generated once per session, off the chat critical path
+title_cache = TitleCache()
+
+def _prefetch_title(request: ChatProcessRequest) -> None:
+    """Kicks off background title generation for the session if it has none yet."""
+    title_cache.prefetch(
+        request.session_id,
+        [*request.chat_history, Message(role="user", content=request.user_message)],
+        _gen_title,
+    )
+
+# Startup waits at most this long for the provider warmup
+_WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT_SECONDS", "5"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the provider's static prompt prefixes before serving the first request,
+    # without letting an unreachable provider hold up worker startup
+    try:
+        await asyncio.wait_for(ai_service.warmup(), timeout=_WARMUP_TIMEOUT)
+    except TimeoutError:
+        log.warning("Provider warmup timed out after %ss", _WARMUP_TIMEOUT)
+    yield
+    await aclose_shared_client()
+    await aclose_news_client()
+    shutdown_logging()
+
+app = FastAPI(
+    title="AI Microservice (Multi-Model)",
+    version="2.1.0",
+    lifespan=lifespan,
+)
+
+# Fixed replies for empty inputs, serialized once
+_NO_TRADES_BODY = orjson.dumps({"summary": "No trades to analyze.", "insights": []})
+_DEFAULT_TITLE_BODY = orjson.dumps({"title": "New Chat"})
+
+async def _extract_or_none(user_message: str):
+    """Trade extraction that logs and returns None on failure, so it never sinks the chat reply."""
+    try:
+        return await _extract(user_message)
+    except Exception:
+        log.exception("process_chat extraction failed")
+        return None
 
-# --- Router Endpoints (Directly call the selected ai_service instance) ---
+# --- Router Endpoints (Directly call the selected provider instance) ---
 
-@app.post("/ai/process-chat", response_model=AIMessageResponse)
+@app.post("/ai/process-chat", response_model=AIMessageResponse, response_model_exclude_none=True)
 async def process_chat(request: ChatProcessRequest):
     """
     Handles chat, extraction, and grounding by routing to the selected provider.
     """
+    _prefetch_title(request)
     try:
-        chat_result = await ai_service.generate_chat_response(
-            request.user_message, 
-            request.chat_history, 
-            request.trade_history
-        )
-        # Note: Extraction is run concurrently with conversation inside the service
-        extracted_trade = await ai_service.extract_trade_from_text(request.user_message)
+        # Both are upstream LLM round-trips and independent, so overlap them.
+        # Messages that can't be a trade report skip extraction entirely.
+        # If the chat task fails the group cancels extraction instead of
+        # leaving it running for a reply that will never be sent.
+        extract_task = None
+        try:
+            async with asyncio.TaskGroup() as tg:
+                chat_task = tg.create_task(_gen_chat(
+                    request.user_message, 
+                    request.chat_history, 
+                    request.trade_history,
+                    session_id=request.session_id,
+                    intent=request.intent,
+                ))
+                if may_contain_trade(request.user_message):
+                    extract_task = tg.create_task(_extract_or_none(request.user_message))
+        except ExceptionGroup as eg:
+            # Only the chat task can fail here; surface its error as-is
+            raise eg.exceptions[0]
+        chat_result = chat_task.result()
+        extracted_trade = extract_task.result() if extract_task else None
         
+        # FastAPI serializes through the response_model with pydantic-core.
+        # None fields are left out (response_model_exclude_none), so most
+        # replies carry no trade_extracted key at all
         return AIMessageResponse(
             message=chat_result["message"],
             is_grounded=chat_result["is_grounded"],
-            trade_extracted=extracted_trade
+            trade_extracted=extracted_trade,
         )
 
     except Exception as e:
-        print(f"❌ Error in process_chat: {e}")
+        log.exception("process_chat failed")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"AI Microservice Error: {str(e)}")
 
-@app.post("/ai/extract-trade", response_model=Optional[TradeCreate])
+@app.post("/ai/process-chat/stream")
+async def process_chat_stream(request: ChatProcessRequest):
+    """
+    Server-Sent Events variant of /ai/process-chat.
+    Emits one `data:` event per text chunk, then a terminal `done` event
+    carrying is_grounded and trade_extracted.
+    """
+    _prefetch_title(request)
+
+    async def events():
+        # Extraction doesn't depend on the reply, so it runs while the reply streams.
+        # Started here rather than in the endpoint so the finally below always
+        # covers it, even if the client disconnects before streaming begins.
+        extraction = None
+        if may_contain_trade(request.user_message):
+            extraction = asyncio.create_task(_extract(request.user_message))
+        is_grounded = False
+        try:
+            async for item in _stream_chat(
+                request.user_message,
+                request.chat_history,
+                request.trade_history,
+                session_id=request.session_id,
+                intent=request.intent,
+            ):
+                if isinstance(item, dict):
+                    is_grounded = item.get("is_grounded", False)
+                    continue
+                yield b"data: " + orjson.dumps(item) + b"\n\n"
+
+            trade = None
+            if extraction is not None:
+                try:
+                    trade = await extraction
+                except Exception:
+                    log.exception("process_chat_stream extraction failed")
+            done = {
+                "is_grounded": is_grounded,
+                "trade_extracted": trade.model_dump(mode="json", exclude_none=True) if trade else None,
+            }
+            yield b"event: done\ndata: " + orjson.dumps(done) + b"\n\n"
+        finally:
+            if extraction is not None:
+                extraction.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post(
+    "/ai/extract-trade",
+    response_model=TradeCreate,
+    response_model_exclude_none=True,
+    responses={204: {"description": "No trade found in the text"}},
+)
 async def extract_trade_endpoint(request: TradeExtractionRequest):
-    """Direct endpoint to extract trade data (e.g., for quick logging forms)."""
+    """Direct endpoint to extract trade data (e.g., for quick logging forms). 204 when there is no trade."""
     try:
-        return await ai_service.extract_trade_from_text(request.text)
+        trade = await _extract(request.text)
+        if trade is None:
+            return Response(status_code=status.HTTP_204_NO_CONTENT)
+        return trade
     except Exception as e:
-        print(f"❌ Error in extract_trade_endpoint: {e}")
+        log.exception("extract_trade_endpoint failed")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"AI Microservice Error: {str(e)}")
 
 
+@app.post("/ai/trade-context", status_code=status.HTTP_204_NO_CONTENT)
+async def trade_context_endpoint(request: TradeContextUpdateRequest):
+    """Write path: appends a newly recorded trade to the session's precomputed chat context."""
+    update_trade_context(request.session_id, request.trade)
+
+
 @app.post("/ai/analyze-trades", response_model=InsightsResponse)
 async def analyze_trades_endpoint(request: TradeAnalysisRequest):
     """Generates analysis insights from a list of trades."""
+    # Nothing to analyze: answer without an LLM round-trip
+    if not request.trades:
+        return Response(content=_NO_TRADES_BODY, media_type="application/json")
     try:
-        result = await ai_service.analyze_trades(request.trades)
-        return InsightsResponse(
+        result = await _analyze(request.trades)
+        # LLM output, so this one is still validated before it goes out
+        insights = InsightsResponse(
             summary=result.get("summary", "Analysis unavailable"),
             insights=result.get("insights", [])
         )
+        return insights
     except Exception as e:
-        print(f"❌ Error in analyze_trades_endpoint: {e}")
+        log.exception("analyze_trades_endpoint failed")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"AI Microservice Error: {str(e)}")
 
 
 @app.post("/ai/generate-title", response_model=TitleResponse)
 async def generate_title_endpoint(request: TitleGenerationRequest):
     """Generates a short title for a conversation."""
+    if not request.messages:
+        return Response(content=_DEFAULT_TITLE_BODY, media_type="application/json")
     try:
-        title = await ai_service.generate_title_for_chat(request.messages)
+        title = await title_cache.get_or_generate(
+            request.session_id, request.messages, _gen_title
+        )
         return TitleResponse(title=title or "New Chat")
     except Exception as e:
-        print(f"❌ Error in generate_title_endpoint: {e}")
+        log.exception("generate_title_endpoint failed")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"AI Microservice Error: {str(e)}")
 
 
+# Static payload, rendered once: liveness probes hit this constantly
+_HEALTH_BODY = orjson.dumps({"status": "ok", "service": "ai-microservice", "provider": service_name})
+
 @app.get("/health")
 def health():
     """Health check for the microservice."""
-    return {"status": "ok", "service": "ai-microservice", "provider": service_name}
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 
 if __name__ == "__main__":
+    # Local/dev entrypoint; production runs under gunicorn via run.sh.
+    # Reload only for local development; it can't be combined with multiple workers
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
     uvicorn.run(
         "main:app", 
         host=settings.HOST, 
         port=settings.PORT, 
-        reload=True,
-        log_level="info", 
+        reload=os.environ.get("ENV") == "dev" and workers == 1,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+        log_level="warning", 
+        # Keep the root QueueHandler setup from app.logging_setup; uvicorn's loggers propagate to it
+        log_config=None,
         factory=False
     )
\ No newline at end of file
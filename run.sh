@@ -0,0 +1,10 @@
+#!/usr/bin/env sh
+# Production entrypoint: one uvicorn event loop per gunicorn worker process.
+# Caches and Grok chat sessions are per worker, so each worker warms its own.
+# For local development with reload, use `ENV=dev python main.py` instead.
+exec gunicorn main:app \
+    -k uvicorn_worker.UvicornWorker \
+    -w "${WEB_CONCURRENCY:-4}" \
+    --bind "${HOST:-0.0.0.0}:${PORT:-8001}" \
+    --timeout "${GUNICORN_TIMEOUT:-120}" \
+    --graceful-timeout 30
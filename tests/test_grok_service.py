@@ -0,0 +1,148 @@
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from xai_sdk.aio.chat import Chat, Client as ChatClient
+
+os.environ.setdefault("XAI_API_KEY", "test-key")
+# No SQLite file for the intent cache
+os.environ["INTENT_CACHE_DB"] = ""
+
+from app.grok_service import GrokService  # noqa: E402
+from app.history import history_tokens  # noqa: E402
+from app.models import Message  # noqa: E402
+
+
+def _response(content: str, tool_calls=()):
+    return SimpleNamespace(content=content, tool_calls=list(tool_calls))
+
+
+class GrokSdkSignatureTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Drives GrokService against mocks autospecced from the installed xai_sdk,
+    so calling create/sample/stream with arguments the SDK doesn't accept
+    raises TypeError here instead of being swallowed by the service's fallbacks.
+    """
+
+    def setUp(self):
+        self.service = GrokService()
+        self.chat = mock.create_autospec(Chat, instance=True)
+        self.service.client = SimpleNamespace(chat=mock.create_autospec(ChatClient, instance=True))
+        self.service.client.chat.create.return_value = self.chat
+
+    def test_sample_and_stream_take_no_arguments(self):
+        self.assertRaises(TypeError, self.chat.sample, temperature=0.0)
+        self.assertRaises(TypeError, self.chat.stream, tools=())
+
+    async def test_extract_sets_params_on_create(self):
+        self.chat.sample.return_value = _response('{"intent": "OTHER", "trade": null}')
+
+        self.assertIsNone(await self.service.extract_trade_from_text("hello there"))
+        kwargs = self.service.client.chat.create.call_args.kwargs
+        self.assertEqual(kwargs["temperature"], 0.0)
+        self.assertEqual(kwargs["response_format"], "json_object")
+        self.chat.sample.assert_awaited_once_with()
+
+    async def test_extract_returns_trade(self):
+        self.chat.sample.return_value = _response(
+            '{"intent": "LOG_TRADE", "trade": {"ticker": "AAPL", "entry_date": "2024-01-02", '
+            '"entry_price": 150, "quantity": 10}}'
+        )
+
+        trade = await self.service.extract_trade_from_text("bought 10 AAPL at 150")
+        self.assertEqual(trade.ticker, "AAPL")
+
+    async def test_warmup_failure_does_not_trip_breaker(self):
+        self.chat.sample.side_effect = RuntimeError("unreachable")
+
+        await self.service.warmup()
+        self.assertEqual(self.service.breaker._failures, 0)
+        self.chat.sample.assert_awaited_once_with()
+
+    async def test_title_uses_model_output(self):
+        self.chat.sample.return_value = _response('{"title": "AAPL swing trade"}')
+
+        title = await self.service.generate_title_for_chat([])
+        self.assertEqual(title, "AAPL swing trade")
+        self.assertEqual(self.service.client.chat.create.call_args.kwargs["max_tokens"], 32)
+
+    async def test_chat_passes_tools_on_create(self):
+        self.chat.sample.return_value = _response("Hello!")
+
+        result = await self.service.generate_chat_response("hi", [], [])
+        self.assertEqual(result, {"message": "Hello!", "is_grounded": False})
+        self.assertTrue(self.service.client.chat.create.call_args.kwargs["tools"])
+
+    async def test_chat_runs_news_tool_calls(self):
+        call = SimpleNamespace(
+            id="call-1",
+            function=SimpleNamespace(name="fetch_stock_news", arguments='{"query": "NVDA"}'),
+        )
+        self.chat.sample.side_effect = [_response("", [call]), _response("NVDA is up.")]
+
+        with mock.patch("app.grok_service.fetch_stock_news", mock.AsyncMock(return_value='{"articles": []}')) as news:
+            result = await self.service.generate_chat_response("What's moving NVDA?", [], [])
+
+        self.assertEqual(result, {"message": "NVDA is up.", "is_grounded": True})
+        news.assert_awaited_once_with("NVDA")
+        tool_message = self.chat.append.call_args_list[-2].args[0]
+        self.assertEqual(tool_message.tool_call_id, "call-1")
+
+    async def test_session_reuses_chat_only_while_history_matches(self):
+        self.chat.sample.return_value = _response("Hello!")
+        create = self.service.client.chat.create
+
+        await self.service.generate_chat_response("hi", [], [], session_id="s1")
+        history = [Message(role="user", content="hi"), Message(role="assistant", content="Hello!")]
+        await self.service.generate_chat_response("again", history, [], session_id="s1")
+        self.assertEqual(create.call_count, 1)
+
+        # Turn 3 was served by another worker: this chat is missing it
+        history = history + [
+            Message(role="user", content="again"), Message(role="assistant", content="Hello!"),
+            Message(role="user", content="q"), Message(role="assistant", content="a"),
+        ]
+        await self.service.generate_chat_response("fourth", history, [], session_id="s1")
+        self.assertEqual(create.call_count, 2)
+
+    async def test_session_rebuilds_once_history_outgrows_budget(self):
+        self.chat.sample.return_value = _response("ok")
+        create = self.service.client.chat.create
+        turn = [Message(role="user", content="how is my AAPL trade"), Message(role="assistant", content="ok")]
+        history = []
+
+        # Room for exactly one past turn
+        with mock.patch("app.grok_service.HISTORY_TOKEN_BUDGET", history_tokens(turn)):
+            for _ in range(3):
+                await self.service.generate_chat_response(turn[0].content, history, [], session_id="s1")
+                history = history + turn
+
+        # Turn 2 still fits the budget; turn 3's held history doesn't, so it is re-packed
+        self.assertEqual(create.call_count, 2)
+
+    async def test_stream_yields_chunks(self):
+        final = _response("Hello!")
+
+        async def stream():
+            yield final, SimpleNamespace(content="Hel")
+            yield final, SimpleNamespace(content="lo!")
+
+        self.chat.stream.side_effect = stream
+
+        items = [item async for item in self.service.stream_chat_response("hi", [], [])]
+        self.assertEqual(items, ["Hel", "lo!", {"is_grounded": False, "done": True}])
+
+    async def test_empty_stream_falls_back(self):
+        async def stream():
+            return
+            yield
+
+        self.chat.stream.side_effect = stream
+
+        items = [item async for item in self.service.stream_chat_response("hi", [], [])]
+        self.assertEqual(items, ["Grok service is currently unavailable.", {"is_grounded": False, "done": True}])
+
+
+if __name__ == "__main__":
+    unittest.main()
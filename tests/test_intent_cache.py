@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+
+from app.intent_cache import SemanticIntentCache
+
+
+class IntentCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = SemanticIntentCache()
+
+    async def test_lookup_serves_remembered_intent(self):
+        self.assertIsNone(await self.cache.lookup("Hi there"))
+        await self.cache.remember("Hi there", "OTHER")
+
+        self.assertEqual(await self.cache.lookup("  hi THERE "), "OTHER")
+        self.assertEqual(self.cache.peek("hi there"), "OTHER")
+
+    async def test_lookup_uses_semantic_tier_and_remember_reuses_its_embedding(self):
+        embedding = object()
+        self.cache._embed = mock.AsyncMock(return_value=embedding)
+        self.cache._nearest = mock.Mock(side_effect=[None, "NEWS_MARKET"])
+        self.cache._put_semantic = mock.Mock()
+
+        self.assertIsNone(await self.cache.lookup("what's up with NVDA"))
+        await self.cache.remember("what's up with NVDA", "NEWS_MARKET")
+        self.cache._embed.assert_awaited_once()
+        self.cache._put_semantic.assert_called_once_with(embedding, "NEWS_MARKET")
+
+        # A near-duplicate phrasing is served by the semantic tier
+        self.assertEqual(await self.cache.lookup("whats up w/ NVDA"), "NEWS_MARKET")
+        self.assertEqual(self.cache.peek("whats up w/ NVDA"), "NEWS_MARKET")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from app.prefilter import may_contain_trade
+
+TRADE_REPORTS = [
+    "Bought 10 AAPL at 150",
+    "sold 5 TSLA @ 250",
+    "Purchased 10 AAPL at 150",
+    "Added 50 NVDA at 420",
+    "Closed my TSLA at 250",
+    "got into AMD at 155 x 20",
+    "Covered my short on GME at 22",
+    "Opened 2 SPY 450 calls",
+    "Trimmed 25 shares of MSFT",
+    "scaled out of META at 310",
+    "entered QQQ 380 this morning",
+    "AMZN 130 x 15",
+    "long 100 F from 12.5",
+]
+
+NON_TRADES = [
+    "hi",
+    "thanks!",
+    "what is NVDA doing?",
+    "How did my 2023 go?",
+    "What's the news on AAPL today?",
+    "Should I buy TSLA?",
+]
+
+
+class MayContainTradeTest(unittest.TestCase):
+    def test_trade_reports_pass(self):
+        for text in TRADE_REPORTS:
+            with self.subTest(text=text):
+                self.assertTrue(may_contain_trade(text))
+
+    def test_non_trades_are_skipped(self):
+        for text in NON_TRADES:
+            with self.subTest(text=text):
+                self.assertFalse(may_contain_trade(text))
+
+
+if __name__ == "__main__":
+    unittest.main()
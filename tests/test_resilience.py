@@ -0,0 +1,41 @@
+import unittest
+
+from app.resilience import CircuitBreaker, CircuitOpenError
+
+
+class TransientError(Exception):
+    pass
+
+
+async def _raise(exc):
+    raise exc
+
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(
+            "test", fail_max=2, is_failure=lambda exc: isinstance(exc, TransientError)
+        )
+
+    async def test_client_errors_do_not_open_the_circuit(self):
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                await self.breaker.call(_raise, ValueError("bad request"))
+        self.assertFalse(self.breaker.is_open)
+
+    async def test_transient_errors_open_the_circuit(self):
+        for _ in range(2):
+            with self.assertRaises(TransientError):
+                await self.breaker.call(_raise, TransientError())
+        self.assertTrue(self.breaker.is_open)
+        with self.assertRaises(CircuitOpenError):
+            await self.breaker.call(_raise, TransientError())
+
+    def test_default_counts_every_error(self):
+        breaker = CircuitBreaker("test", fail_max=1)
+        breaker.record_error(ValueError())
+        self.assertTrue(breaker.is_open)
+
+
+if __name__ == "__main__":
+    unittest.main()
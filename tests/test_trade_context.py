@@ -0,0 +1,32 @@
+import unittest
+
+from app import trade_context
+from app.trade_context import session_trade_context, update_trade_context
+
+
+class SessionTradeContextTest(unittest.TestCase):
+    def setUp(self):
+        trade_context._sessions.clear()
+
+    def test_edited_trade_reseeds(self):
+        open_trade = {"id": 1, "ticker": "TSLA", "exit_price": None}
+        self.assertIn('"exit_price":null', session_trade_context("s1", [open_trade]))
+
+        closed_trade = {**open_trade, "exit_price": 250}
+        self.assertIn('"exit_price":250', session_trade_context("s1", [closed_trade]))
+
+    def test_pushed_trade_is_served_once_history_matches(self):
+        first, second = {"id": 1, "ticker": "AAPL"}, {"id": 2, "ticker": "AMD"}
+        session_trade_context("s1", [first])
+        update_trade_context("s1", second)
+
+        rendered = trade_context._sessions["s1"][1]
+        self.assertIs(session_trade_context("s1", [first, second]), rendered)
+
+    def test_sessions_do_not_share_context(self):
+        self.assertIn("AAPL", session_trade_context("s1", [{"id": 1, "ticker": "AAPL"}]))
+        self.assertIn("NVDA", session_trade_context("s2", [{"id": 1, "ticker": "NVDA"}]))
+
+
+if __name__ == "__main__":
+    unittest.main()